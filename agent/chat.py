@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from shared.codec import dumps_text
+
+
+logger = logging.getLogger("paylabs-agent.chat")
+
+# Static so the system message bytes stay identical across chats.
+CHAT_SYSTEM_PROMPT = (
+    "You answer a merchant's follow-up questions about a financial report that was already generated.\n"
+    "The report snapshot (metrics, evidence query results and narratives) is the primary source. "
+    "Answer from it whenever it contains what is needed, in the language of the question, concisely, "
+    "citing the figures you use.\n"
+    "Only if the snapshot cannot answer the question, request ONE of these queries over this merchant's data "
+    "for a date range (revenue is net amount of SUCCESS transactions):\n"
+    "- revenue_by_day: day, transactions, revenue\n"
+    "- revenue_by_hour: hour, transactions, revenue\n"
+    "- revenue_by_payment_method: payment_method, transactions, revenue\n"
+    "- transactions_by_status: status, transactions, gross_amount (all statuses)\n"
+    "- fees: gross_amount, fees, net_amount, fee_pct\n"
+    "- items_by_quantity: item_name, category, quantity, sales\n"
+    "- categories_by_quantity: category, quantity, sales\n"
+    'Reply with JSON only: {"answer": "<answer or empty>", '
+    '"query": {"name": "<query name>", "start_date": "YYYY-MM-DD", "end_date": "YYYY-MM-DD"} or null}.'
+)
+QUERY_RESULT_PROMPT = (
+    "Result of your query:\n{result}\n\n"
+    'Answer the question now. Reply with JSON only: {{"answer": "<answer>", "query": null}}.'
+)
+
+
+@dataclass
+class ReportSnapshot:
+    report_id: str
+    merchant_id: str
+    start_date: str
+    end_date: str
+    data: dict[str, Any] = field(repr=False)
+    # Serialised once so every turn sends the same prompt prefix.
+    prompt_text: str = field(repr=False, default="")
+
+    @classmethod
+    def from_data(cls, report_id: str, data: dict[str, Any]) -> "ReportSnapshot":
+        body = {
+            "period": {"start_date": data["start_date"], "end_date": data["end_date"]},
+            "metrics": data.get("metrics", {}),
+            "evidence": data.get("evidence", {}),
+            "narratives": data.get("narratives", {}),
+        }
+        return cls(
+            report_id=report_id,
+            merchant_id=data["merchant_id"],
+            start_date=data["start_date"],
+            end_date=data["end_date"],
+            data=body,
+            prompt_text=dumps_text(body),
+        )
+
+
+class TTLCache:
+    def __init__(self, max_entries: int, ttl_seconds: float) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Any | None:
+        entry = self._entries.get(key)
+        if not entry or entry[0] <= time.monotonic():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: str, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+@dataclass
+class ChatSession:
+    chat_id: str
+    report_id: str
+    merchant_id: str
+    turns: deque = field(default_factory=deque)
+
+
+def history_messages(turns: list[dict[str, Any]]) -> list[BaseMessage]:
+    return [
+        HumanMessage(content=turn["content"]) if turn["role"] == "user" else AIMessage(content=turn["content"])
+        for turn in turns
+    ]
+
+
+def build_messages(snapshot: ReportSnapshot, turns: list[dict[str, Any]], question: str) -> list[BaseMessage]:
+    return [
+        SystemMessage(content=CHAT_SYSTEM_PROMPT),
+        HumanMessage(content=f"Report snapshot:\n{snapshot.prompt_text}"),
+        *history_messages(turns),
+        HumanMessage(content=question),
+    ]
+
+
+class ChatLogRejected(Exception):
+    # Raised by the flush callback when a batch can never be written (e.g. it
+    # fails validation), so retrying it would only block the queue.
+    pass
+
+
+class ChatLogWriter:
+    def __init__(
+        self,
+        flush: Callable[[list[dict[str, Any]]], Awaitable[bool]],
+        batch_size: int = 50,
+        interval_seconds: float = 0.5,
+        max_pending: int = 10000,
+        max_attempts: int = 5,
+    ) -> None:
+        self._flush = flush
+        self.batch_size = batch_size
+        self.interval_seconds = interval_seconds
+        self.max_pending = max_pending
+        self.max_attempts = max(1, max_attempts)
+        self._pending: list[dict[str, Any]] = []
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+        # Failed attempts of the batch at the head of the queue.
+        self._head_attempts = 0
+        self.written = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.failed_flushes = 0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def append(self, turns: list[dict[str, Any]]) -> None:
+        self._pending.extend(turns)
+        overflow = len(self._pending) - self.max_pending
+        if overflow > 0:
+            del self._pending[:overflow]
+            self.dropped += overflow
+            self._head_attempts = 0
+        if len(self._pending) >= self.batch_size:
+            self._wake.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            while self._pending:
+                batch = self._pending[: self.batch_size]
+                del self._pending[: len(batch)]
+                try:
+                    ok = await self._flush(batch)
+                except ChatLogRejected as exc:
+                    logger.error("Chat log batch rejected; dropping it | turns=%s | error=%s", len(batch), exc)
+                    self.failed_flushes += 1
+                    self.rejected += len(batch)
+                    self._head_attempts = 0
+                    continue
+                except Exception as exc:
+                    logger.error("Chat log flush failed | turns=%s | error=%s", len(batch), exc)
+                    ok = False
+                if not ok:
+                    self.failed_flushes += 1
+                    self._head_attempts += 1
+                    if self._head_attempts >= self.max_attempts:
+                        logger.error(
+                            "Chat log batch failed %s times; dropping it | turns=%s",
+                            self._head_attempts,
+                            len(batch),
+                        )
+                        self.dropped += len(batch)
+                        self._head_attempts = 0
+                        continue
+                    # Requeue in front; turns carry log_id so a retry that
+                    # overlaps a committed write is deduplicated in the DB.
+                    self._pending[:0] = batch
+                    return
+                self._head_attempts = 0
+                self.written += len(batch)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._pending:
+            logger.error("Chat turns not persisted at shutdown | turns=%s", len(self._pending))
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "written": self.written,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+            "failed_flushes": self.failed_flushes,
+        }
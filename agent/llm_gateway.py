@@ -0,0 +1,304 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, TypeVar
+
+
+logger = logging.getLogger("paylabs-agent.llm")
+
+T = TypeVar("T")
+
+
+class LLMUnavailableError(RuntimeError):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, capacity_per_minute: float) -> None:
+        self.capacity = float(capacity_per_minute)
+        self.rate_per_second = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate_per_second)
+        self.updated_at = now
+
+    def reserve(self, amount: float) -> float:
+        # Debit up front (the balance may go negative) and return how long the
+        # caller must wait for the debt to be repaid. Runs on the event loop
+        # thread only, so no locking is needed.
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate_per_second
+
+    def refund(self, amount: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + min(amount, self.capacity))
+
+    def available(self) -> float:
+        self._refill()
+        return round(self.tokens, 2)
+
+
+class AdaptiveConcurrencyLimiter:
+    # AIMD on observed latency: +1 slot after a full window of fast successes,
+    # halve the limit on an error or a call slower than the target latency.
+    def __init__(self, initial: int, min_limit: int, max_limit: int, target_latency_seconds: float) -> None:
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = min(self.max_limit, max(self.min_limit, initial))
+        self.target_latency_seconds = target_latency_seconds
+        self.inflight = 0
+        self.waiting = 0
+        self._fast_successes = 0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self, timeout: float | None = None) -> bool:
+        # The timed wait happens inside the condition and the slot is only
+        # taken afterwards, so a timeout or cancellation never leaks a slot.
+        async with self._cond:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._cond.wait_for(lambda: self.inflight < self.limit), timeout)
+            except asyncio.TimeoutError:
+                return False
+            finally:
+                self.waiting -= 1
+            self.inflight += 1
+            return True
+
+    async def release(self, ok: bool, latency_seconds: float | None) -> None:
+        async with self._cond:
+            self.inflight -= 1
+            if ok and latency_seconds is not None and latency_seconds <= self.target_latency_seconds:
+                self._fast_successes += 1
+                if self._fast_successes >= self.limit:
+                    self.limit = min(self.max_limit, self.limit + 1)
+                    self._fast_successes = 0
+            elif ok is not None:
+                self.limit = max(self.min_limit, self.limit // 2)
+                self._fast_successes = 0
+            self._cond.notify_all()
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, cooldown_seconds: float) -> None:
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown_seconds = cooldown_seconds
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.cooldown_seconds:
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == self.HALF_OPEN:
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+        return True
+
+    def release_probe(self) -> None:
+        self._probe_in_flight = False
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.trips += 1
+                logger.warning(
+                    "LLM circuit breaker opened | consecutive_failures=%s | cooldown_seconds=%s",
+                    self.consecutive_failures,
+                    self.cooldown_seconds,
+                )
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class LLMGateway:
+    def __init__(
+        self,
+        requests_per_minute: int = 60,
+        tokens_per_minute: int = 100_000,
+        initial_concurrency: int = 4,
+        min_concurrency: int = 1,
+        max_concurrency: int = 16,
+        target_latency_seconds: float = 20.0,
+        attempt_timeout_seconds: float = 45.0,
+        budget_seconds: float = 90.0,
+        max_retries: int = 2,
+        backoff_base_seconds: float = 0.5,
+        backoff_max_seconds: float = 8.0,
+        breaker_failure_threshold: int = 5,
+        breaker_cooldown_seconds: float = 30.0,
+        max_queue: int = 32,
+    ) -> None:
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.limiter = AdaptiveConcurrencyLimiter(
+            initial_concurrency, min_concurrency, max_concurrency, target_latency_seconds
+        )
+        self.breaker = CircuitBreaker(breaker_failure_threshold, breaker_cooldown_seconds)
+        self.attempt_timeout_seconds = attempt_timeout_seconds
+        self.budget_seconds = budget_seconds
+        self.max_retries = max(0, max_retries)
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.max_queue = max_queue
+        self.queued = 0
+        self.counters = {"calls": 0, "succeeded": 0, "failed": 0, "retries": 0, "rejected": 0}
+
+    @classmethod
+    def from_env(cls) -> "LLMGateway":
+        requests_per_minute = int(os.getenv("AGENT_LLM_RPM", "60"))
+        tokens_per_minute = int(os.getenv("AGENT_LLM_TPM", "100000"))
+        # A zero-capacity bucket would never make a caller wait, i.e. it
+        # would silently disable rate limiting.
+        if requests_per_minute <= 0:
+            raise ValueError("AGENT_LLM_RPM must be > 0")
+        if tokens_per_minute <= 0:
+            raise ValueError("AGENT_LLM_TPM must be > 0")
+        return cls(
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+            initial_concurrency=int(os.getenv("AGENT_LLM_CONCURRENCY", "4")),
+            min_concurrency=int(os.getenv("AGENT_LLM_MIN_CONCURRENCY", "1")),
+            max_concurrency=int(os.getenv("AGENT_LLM_MAX_CONCURRENCY", "16")),
+            target_latency_seconds=float(os.getenv("AGENT_LLM_TARGET_LATENCY_SECONDS", "20")),
+            attempt_timeout_seconds=float(os.getenv("AGENT_LLM_TIMEOUT_SECONDS", "45")),
+            budget_seconds=float(os.getenv("AGENT_LLM_BUDGET_SECONDS", "90")),
+            max_retries=int(os.getenv("AGENT_LLM_MAX_RETRIES", "2")),
+            breaker_failure_threshold=int(os.getenv("AGENT_LLM_BREAKER_FAILURES", "5")),
+            breaker_cooldown_seconds=float(os.getenv("AGENT_LLM_BREAKER_COOLDOWN_SECONDS", "30")),
+            max_queue=int(os.getenv("AGENT_LLM_MAX_QUEUE", "32")),
+        )
+
+    def _reject(self, reason: str) -> LLMUnavailableError:
+        self.counters["rejected"] += 1
+        return LLMUnavailableError(reason)
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: uniform in [0, min(cap, base * 2^attempt)].
+        return random.uniform(0, min(self.backoff_max_seconds, self.backoff_base_seconds * (2**attempt)))
+
+    async def _wait_for_rate(self, estimated_tokens: int, deadline: float) -> None:
+        wait = max(self.request_bucket.reserve(1), self.token_bucket.reserve(estimated_tokens))
+        if wait <= 0:
+            return
+        if time.monotonic() + wait > deadline:
+            self.request_bucket.refund(1)
+            self.token_bucket.refund(estimated_tokens)
+            raise self._reject("rate limit wait exceeds LLM budget")
+        await asyncio.sleep(wait)
+
+    async def invoke(
+        self,
+        call: Callable[[], Awaitable[T]],
+        estimated_tokens: int = 0,
+        deadline: float | None = None,
+    ) -> T:
+        if not self.breaker.allow():
+            raise self._reject("LLM circuit breaker is open")
+        if self.queued >= self.max_queue:
+            self.breaker.release_probe()
+            raise self._reject("LLM queue is full")
+
+        self.counters["calls"] += 1
+        # ``deadline`` (time.monotonic) lets a caller's request deadline cut
+        # the budget short.
+        budget_deadline = time.monotonic() + self.budget_seconds
+        deadline = min(budget_deadline, deadline) if deadline is not None else budget_deadline
+        attempt = 0
+        try:
+            while True:
+                self.queued += 1
+                try:
+                    await self._wait_for_rate(estimated_tokens, deadline)
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._reject("LLM budget exhausted while queued")
+                    if not await self.limiter.acquire(remaining):
+                        raise self._reject("LLM budget exhausted while queued")
+                finally:
+                    self.queued -= 1
+
+                started = time.monotonic()
+                ok: bool | None = None
+                cut_short = False
+                try:
+                    timeout = min(self.attempt_timeout_seconds, max(0.0, deadline - started))
+                    result = await asyncio.wait_for(call(), timeout)
+                    ok = True
+                except Exception as exc:
+                    ok = False
+                    error = exc
+                    # Cut short by the caller's deadline, not a provider failure.
+                    cut_short = deadline < budget_deadline and time.monotonic() >= deadline
+                finally:
+                    latency = time.monotonic() - started
+                    # Neither a cut-short nor a cancelled attempt says anything
+                    # about the provider, so the AIMD limit is left alone.
+                    await self.limiter.release(None if cut_short else ok, latency if ok else None)
+
+                if ok:
+                    self.breaker.record_success()
+                    self.counters["succeeded"] += 1
+                    return result
+
+                if cut_short:
+                    raise error
+                self.breaker.record_failure()
+                logger.warning(
+                    "LLM call attempt failed | attempt=%s | latency=%.2fs | error=%s",
+                    attempt + 1,
+                    latency,
+                    type(error).__name__,
+                )
+                if self.breaker.state == CircuitBreaker.OPEN or attempt >= self.max_retries:
+                    raise error
+                delay = self._backoff(attempt)
+                if time.monotonic() + delay >= deadline:
+                    raise error
+                self.counters["retries"] += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+        except LLMUnavailableError:
+            self.breaker.release_probe()
+            raise
+        except BaseException:
+            self.counters["failed"] += 1
+            self.breaker.release_probe()
+            raise
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "breaker_state": self.breaker.state,
+            "breaker_trips": self.breaker.trips,
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "queue_depth": self.queued,
+            "inflight": self.limiter.inflight,
+            "concurrency_limit": self.limiter.limit,
+            "requests_available": self.request_bucket.available(),
+            "tokens_available": self.token_bucket.available(),
+            **self.counters,
+        }
@@ -0,0 +1,195 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import uuid
+from collections.abc import Mapping
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from typing import Any
+
+from shared.codec import dumps_text
+
+
+_TRUNCATED = "...(truncated)"
+
+_config = {
+    "field_max_chars": 1000,
+    "max_items": 20,
+    "max_depth": 4,
+    "payload_sample_rate": 0.05,
+}
+_listener: logging.handlers.QueueListener | None = None
+_queue_handler: "DroppingQueueHandler | None" = None
+
+
+class _Budget:
+    def __init__(self, chars: int) -> None:
+        self.remaining = chars
+
+
+def _cap(value: Any, budget: _Budget, depth: int) -> Any:
+    # Walks at most max_items per container and stops once the character
+    # budget is spent, so the cost is bounded no matter how large the value is.
+    if budget.remaining <= 0:
+        return _TRUNCATED
+    if value is None or isinstance(value, (bool, int, float)):
+        budget.remaining -= 8
+        return value
+    if isinstance(value, str):
+        if len(value) <= budget.remaining:
+            budget.remaining -= len(value)
+            return value
+        kept = max(0, budget.remaining)
+        budget.remaining = 0
+        return f"{value[:kept]}...(+{len(value) - kept} chars)"
+    max_items = _config["max_items"]
+    if isinstance(value, dict):
+        if depth <= 0:
+            return f"<dict {len(value)} keys>"
+        capped: dict[str, Any] = {}
+        for index, (key, item) in enumerate(value.items()):
+            if index >= max_items or budget.remaining <= 0:
+                capped["..."] = f"+{len(value) - index} more keys"
+                break
+            budget.remaining -= len(str(key))
+            capped[str(key)] = _cap(item, budget, depth - 1)
+        return capped
+    if isinstance(value, (list, tuple)):
+        if depth <= 0:
+            return f"<list {len(value)} items>"
+        items: list[Any] = []
+        for index, item in enumerate(value):
+            if index >= max_items or budget.remaining <= 0:
+                items.append(f"+{len(value) - index} more items")
+                break
+            items.append(_cap(item, budget, depth - 1))
+        return items
+    if isinstance(value, (date, Decimal, uuid.UUID, BaseException)):
+        return _cap(str(value), budget, depth)
+    # repr() of an arbitrary object has no size bound, so only its type is kept.
+    budget.remaining -= 16
+    return f"<{type(value).__name__}>"
+
+
+def cap_value(value: Any) -> Any:
+    return _cap(value, _Budget(_config["field_max_chars"]), _config["max_depth"])
+
+
+def log_event(
+    logger: logging.Logger,
+    level: int,
+    event: str,
+    payload: dict[str, Any] | None = None,
+    **fields: Any,
+) -> None:
+    # ``payload`` holds verbose fields (tool results, LLM text, graph state);
+    # INFO records only carry them for a sampled fraction of calls.
+    if not logger.isEnabledFor(level):
+        return
+    if payload and (
+        level >= logging.WARNING
+        or logger.isEnabledFor(logging.DEBUG)
+        or random.random() < _config["payload_sample_rate"]
+    ):
+        fields.update(payload)
+    # Capping happens here so the queued record is a small immutable snapshot;
+    # JSON encoding and the write happen on the listener thread.
+    capped = {key: cap_value(value) for key, value in fields.items()}
+    logger.log(level, event, extra={"fields": capped})
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry: dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return dumps_text(entry)
+
+
+def _cap_arg(arg: Any) -> Any:
+    if isinstance(arg, (int, float, bool, type(None))):
+        return arg
+    if isinstance(arg, str) and len(arg) <= _config["field_max_chars"]:
+        return arg
+    return cap_value(arg)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue: queue.Queue) -> None:
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Defer message formatting to the listener thread. Plain %-style
+        # records are rendered here only if their args are cheap scalars;
+        # anything else is capped first so a huge dict never gets formatted.
+        if isinstance(record.args, Mapping):
+            # A single mapping backs "%(name)s" formatting and must stay one.
+            record.args = {key: _cap_arg(arg) for key, arg in record.args.items()}
+        elif record.args:
+            args = record.args if isinstance(record.args, tuple) else (record.args,)
+            record.args = tuple(_cap_arg(arg) for arg in args)
+        record.exc_text = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging() -> None:
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+    _config["field_max_chars"] = int(os.getenv("AGENT_LOG_FIELD_MAX_CHARS", "1000"))
+    _config["max_items"] = int(os.getenv("AGENT_LOG_MAX_ITEMS", "20"))
+    _config["payload_sample_rate"] = float(os.getenv("AGENT_LOG_PAYLOAD_SAMPLE_RATE", "0.05"))
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(JsonFormatter())
+    log_queue: queue.Queue = queue.Queue(maxsize=int(os.getenv("AGENT_LOG_QUEUE_SIZE", "10000")))
+    _queue_handler = DroppingQueueHandler(log_queue)
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.handlers[:] = [_queue_handler]
+    root.setLevel(os.getenv("AGENT_LOG_LEVEL", "INFO").upper())
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def logging_stats() -> dict[str, Any]:
+    if _queue_handler is None:
+        return {"configured": False}
+    return {
+        "configured": True,
+        "queue_depth": _queue_handler.queue.qsize(),
+        "dropped": _queue_handler.dropped,
+        "payload_sample_rate": _config["payload_sample_rate"],
+    }
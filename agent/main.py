@@ -1,23 +1,39 @@
 import os
-import json
+import asyncio
+import contextlib
 import logging
-import re
-from datetime import date
+import socket
+import time
+import uuid
+from collections import deque
+from datetime import date, datetime, timezone
 from pathlib import Path
 from typing import Any, TypedDict
 
-from fastapi import FastAPI, HTTPException
-from langchain_core.prompts import ChatPromptTemplate
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import ORJSONResponse
+from langchain_core.messages import AIMessage, HumanMessage
 from langchain_mcp_adapters.client import MultiServerMCPClient
 from langchain_openai import ChatOpenAI
 from langgraph.graph import END, StateGraph
 from pydantic import BaseModel, field_validator
 
-
-logging.basicConfig(
-    level=os.getenv("AGENT_LOG_LEVEL", "INFO").upper(),
-    format="%(asctime)s %(levelname)s %(name)s %(message)s",
+from agent.chat import (
+    QUERY_RESULT_PROMPT,
+    ChatLogRejected,
+    ChatLogWriter,
+    ChatSession,
+    ReportSnapshot,
+    TTLCache,
+    build_messages,
 )
+from agent.llm_gateway import LLMGateway, LLMUnavailableError
+from agent.logging_utils import configure_logging, log_event, logging_stats, shutdown_logging
+from agent.skills import CompiledSkill, SkillRegistry
+from shared.codec import dumps_text, extract_json_object, parse_tool_result
+
+
+configure_logging()
 logger = logging.getLogger("paylabs-agent")
 
 
@@ -26,6 +42,8 @@ class ReportRequest(BaseModel):
     merchant_id: str
     start_date: str
     end_date: str
+    skill: str | None = None
+    deadline_seconds: float | None = None
 
     @field_validator("report_id", "merchant_id")
     @classmethod
@@ -46,45 +64,105 @@ class ReportRequest(BaseModel):
                 raise ValueError("end_date must be >= start_date")
         return end_date
 
+    @field_validator("deadline_seconds")
+    @classmethod
+    def validate_deadline(cls, value: float | None) -> float | None:
+        if value is not None and not 0 < value <= 3600:
+            raise ValueError("deadline_seconds must be between 0 and 3600")
+        return value
+
+
+class ChatRequest(BaseModel):
+    report_id: str
+    merchant_id: str
+    question: str
+    chat_id: str | None = None
+    deadline_seconds: float | None = None
+
+    @field_validator("report_id", "merchant_id", "question")
+    @classmethod
+    def validate_non_empty(cls, value: str) -> str:
+        value = value.strip()
+        if not value:
+            raise ValueError("value cannot be empty")
+        return value
+
+    @field_validator("question")
+    @classmethod
+    def validate_question_length(cls, value: str) -> str:
+        if len(value) > 2000:
+            raise ValueError("question must be at most 2000 characters")
+        return value
+
+    @field_validator("chat_id")
+    @classmethod
+    def validate_chat_id(cls, value: str | None) -> str | None:
+        return str(uuid.UUID(value)) if value else None
+
+    @field_validator("deadline_seconds")
+    @classmethod
+    def validate_deadline(cls, value: float | None) -> float | None:
+        if value is not None and not 0 < value <= 3600:
+            raise ValueError("deadline_seconds must be between 0 and 3600")
+        return value
+
 
 class AgentState(TypedDict, total=False):
     input: dict[str, Any]
+    skill: CompiledSkill
     context: dict[str, Any]
+    claim_token: str
+    claim: dict[str, Any]
     metrics: dict[str, Any]
     evidence: dict[str, Any]
     narratives: dict[str, str]
     update_result: dict[str, Any]
     error: str
     tool_calls_count: int
+    timings_ms: dict[str, float]
+    deadline: float
+    cancel_key: str
+    cancelled: str
 
 
 class AgentRuntime:
     def __init__(self) -> None:
-        self.skill_text = self._load_skill()
-        self.skill_config = self._extract_skill_config(self.skill_text)
+        self.skills = self._load_skills()
         self.mcp_client: MultiServerMCPClient | None = None
         self.tools: dict[str, Any] = {}
         self.llm: ChatOpenAI | None = None
+        self.llm_gateway = LLMGateway.from_env()
+        self.idempotency_ttl_seconds = int(os.getenv("AGENT_IDEMPOTENCY_TTL_SECONDS", "300"))
+        self.claim_lease_seconds = int(os.getenv("AGENT_CLAIM_LEASE_SECONDS", "600"))
+        self.use_item_sketches = os.getenv("AGENT_USE_ITEM_SKETCHES", "false").lower() in {"1", "true", "yes"}
+        self._inflight: dict[str, tuple[dict[str, Any], asyncio.Task]] = {}
+        self._completed: dict[str, tuple[float, dict[str, Any], dict[str, Any]]] = {}
+        self._waiters: dict[str, int] = {}
+        self.request_deadline_seconds = float(os.getenv("AGENT_REQUEST_DEADLINE_SECONDS", "120"))
+        self.cancel_cleanup_seconds = float(os.getenv("AGENT_CANCEL_CLEANUP_SECONDS", "5"))
+        self.cancelled_runs = {"deadline": 0, "client_disconnect": 0}
+        chat_ttl = float(os.getenv("AGENT_CHAT_CACHE_TTL_SECONDS", "1800"))
+        self.report_snapshots = TTLCache(int(os.getenv("AGENT_CHAT_SNAPSHOT_CACHE_SIZE", "256")), chat_ttl)
+        self.chat_sessions = TTLCache(int(os.getenv("AGENT_CHAT_SESSION_CACHE_SIZE", "1024")), chat_ttl)
+        self.chat_history_messages = int(os.getenv("AGENT_CHAT_HISTORY_MESSAGES", "12"))
+        self.chat_query_limit = int(os.getenv("AGENT_CHAT_QUERY_LIMIT", "50"))
+        self.chat_deadline_seconds = float(os.getenv("AGENT_CHAT_DEADLINE_SECONDS", "30"))
+        self.chat_logs = ChatLogWriter(
+            self._write_chat_logs,
+            batch_size=int(os.getenv("AGENT_CHAT_LOG_BATCH_SIZE", "50")),
+            interval_seconds=float(os.getenv("AGENT_CHAT_LOG_FLUSH_INTERVAL_SECONDS", "0.5")),
+            max_attempts=int(os.getenv("AGENT_CHAT_LOG_MAX_ATTEMPTS", "5")),
+        )
         self.graph = self._build_graph()
 
-    def _load_skill(self) -> str:
-        skill_path = Path(
-            os.getenv("SKILL_PATH", "/app/skills/analytic-reporting/SKILL.md")
-        )
-        if skill_path.exists():
-            return skill_path.read_text(encoding="utf-8")
-        return "Use MCP tools safely. Output concise business analysis."
-
-    def _extract_skill_config(self, skill_text: str) -> dict[str, Any]:
-        json_blocks = re.findall(r"```json\s*(\{[\s\S]*?\})\s*```", skill_text)
-        for raw in json_blocks:
-            try:
-                parsed = json.loads(raw)
-                if isinstance(parsed, dict) and "evidence_queries" in parsed:
-                    return parsed
-            except json.JSONDecodeError:
-                continue
-        return {"evidence_queries": []}
+    def _load_skills(self) -> SkillRegistry:
+        # SKILL_PATH (single skill file) is still honoured: its directory name
+        # becomes the default skill and its parent the registry root.
+        skill_path = Path(os.getenv("SKILL_PATH", "/app/skills/analytic-reporting/SKILL.md"))
+        skills_dir = Path(os.getenv("SKILLS_DIR", str(skill_path.parent.parent)))
+        default_skill = os.getenv("AGENT_DEFAULT_SKILL", skill_path.parent.name)
+        reload_interval = float(os.getenv("AGENT_SKILL_RELOAD_INTERVAL_SECONDS", "2"))
+        return SkillRegistry(skills_dir, default_skill, reload_interval)
 
     def _render_sql_template(self, sql_template: str, payload: dict[str, Any]) -> str:
         rendered = sql_template
@@ -93,40 +171,6 @@ class AgentRuntime:
         rendered = rendered.replace("{end_date}", str(payload["end_date"]))
         return rendered
 
-    def _escape_for_prompt_template(self, text: str) -> str:
-        return text.replace("{", "{{").replace("}", "}}")
-
-    def _extract_json_object(self, text: str) -> dict[str, Any] | None:
-        content = text.strip()
-        try:
-            parsed = json.loads(content)
-            if isinstance(parsed, dict):
-                return parsed
-        except json.JSONDecodeError:
-            pass
-
-        fence_match = re.search(r"```(?:json)?\s*(\{[\s\S]*?\})\s*```", content)
-        if fence_match:
-            try:
-                parsed = json.loads(fence_match.group(1))
-                if isinstance(parsed, dict):
-                    return parsed
-            except json.JSONDecodeError:
-                pass
-
-        first_brace = content.find("{")
-        last_brace = content.rfind("}")
-        if first_brace != -1 and last_brace != -1 and last_brace > first_brace:
-            maybe_json = content[first_brace : last_brace + 1]
-            try:
-                parsed = json.loads(maybe_json)
-                if isinstance(parsed, dict):
-                    return parsed
-            except json.JSONDecodeError:
-                pass
-
-        return None
-
     async def startup(self) -> None:
         mcp_url = os.getenv("MCP_URL", "http://mcp-server:5001/mcp")
         self.mcp_client = MultiServerMCPClient(
@@ -139,10 +183,18 @@ class AgentRuntime:
         base_url = os.getenv("AGENT_BASE_URL", os.getenv("OPENAI_BASE_URL", "")).strip()
         model = os.getenv("AGENT_MODEL", os.getenv("OPENAI_MODEL", "qwen-plus"))
         if api_key:
-            kwargs: dict[str, Any] = {"model": model, "api_key": api_key, "temperature": 0.1}
+            # Timeouts and retries are owned by the LLM gateway.
+            kwargs: dict[str, Any] = {
+                "model": model,
+                "api_key": api_key,
+                "temperature": 0.1,
+                "timeout": self.llm_gateway.attempt_timeout_seconds,
+                "max_retries": 0,
+            }
             if base_url:
                 kwargs["base_url"] = base_url
             self.llm = ChatOpenAI(**kwargs)
+        self.chat_logs.start()
         logger.info(
             "Agent startup complete | tools_loaded=%s | llm_enabled=%s | model=%s",
             len(self.tools),
@@ -159,45 +211,72 @@ class AgentRuntime:
                 redacted[key] = value
         return redacted
 
-    async def _mcp_call(self, tool_name: str, payload: dict[str, Any]) -> dict[str, Any]:
-        logger.info("MCP call start | tool=%s | payload=%s", tool_name, self._redact(payload))
+    async def _mcp_call(
+        self,
+        tool_name: str,
+        payload: dict[str, Any],
+        deadline: float | None = None,
+    ) -> dict[str, Any]:
+        log_event(logger, logging.INFO, "MCP call start", tool=tool_name, args=self._redact(payload))
         tool = self.tools.get(tool_name)
         if not tool:
             result = {"ok": False, "error": {"code": "TOOL_NOT_FOUND", "message": tool_name}}
-            logger.error("MCP call failed | tool=%s | result=%s", tool_name, result)
-            return result
-        result = await tool.ainvoke(payload)
-        if isinstance(result, dict):
-            logger.info("MCP call end | tool=%s | result=%s", tool_name, result)
+            log_event(logger, logging.ERROR, "MCP call failed", tool=tool_name, result=result)
             return result
-        if isinstance(result, str):
-            try:
-                parsed = json.loads(result)
-                if isinstance(parsed, dict):
-                    logger.info("MCP call end | tool=%s | result=%s", tool_name, parsed)
-                    return parsed
-            except json.JSONDecodeError:
-                pass
-        if isinstance(result, list):
-            for item in result:
-                if isinstance(item, dict):
-                    text = item.get("text")
-                    if isinstance(text, str):
-                        try:
-                            parsed = json.loads(text)
-                            if isinstance(parsed, dict):
-                                logger.info("MCP call end | tool=%s | result=%s", tool_name, parsed)
-                                return parsed
-                        except json.JSONDecodeError:
-                            continue
+        try:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise asyncio.TimeoutError
+            result = await asyncio.wait_for(tool.ainvoke(payload), remaining)
+        except asyncio.TimeoutError:
+            expired = {
+                "ok": False,
+                "error": {"code": "DEADLINE_EXCEEDED", "message": f"{tool_name} exceeded the request deadline"},
+            }
+            log_event(logger, logging.WARNING, "MCP call timed out", tool=tool_name, result=expired)
+            return expired
+        parsed = parse_tool_result(result)
+        if parsed is not None:
+            log_event(
+                logger,
+                logging.INFO,
+                "MCP call end",
+                tool=tool_name,
+                ok=parsed.get("ok"),
+                error=parsed.get("error"),
+                payload={"result": parsed},
+            )
+            return parsed
         invalid = {"ok": False, "error": {"code": "INVALID_TOOL_RESPONSE", "message": str(result)}}
-        logger.error("MCP call failed | tool=%s | result=%s", tool_name, invalid)
+        log_event(logger, logging.ERROR, "MCP call failed", tool=tool_name, result=invalid)
         return invalid
 
-    def _fallback_narratives(self, metrics: dict[str, Any], evidence: dict[str, Any]) -> dict[str, str]:
+    def _query_budget(self, state: AgentState) -> dict[str, Any]:
+        # Server-side limits for tools that run SQL: the remaining run time,
+        # relative so clock skew between hosts does not matter, bounds every
+        # statement's statement_timeout, and cancel_key lets the run cancel them.
+        remaining_ms = int((state["deadline"] - time.monotonic()) * 1000)
+        return {"timeout_ms": max(1, remaining_ms), "cancel_key": state["cancel_key"]}
+
+    async def _abort_queries_and_mark(self, report_id: str, claim_token: str, cancel_key: str, reason: str) -> None:
+        # The claim token guard means only a run that owns the row marks it.
+        deadline = time.monotonic() + self.cancel_cleanup_seconds
+        await self._mcp_call("cancel_queries", {"cancel_key": cancel_key}, deadline=deadline)
+        await self._mcp_call(
+            "mark_report_cancelled",
+            {"report_id": report_id, "reason": reason, "claim_token": claim_token},
+            deadline=deadline,
+        )
+
+    def _fallback_narratives(
+        self,
+        skill: CompiledSkill,
+        metrics: dict[str, Any],
+        evidence: dict[str, Any],
+    ) -> dict[str, str]:
         total_revenue = metrics.get("total_revenue", 0)
         transaction_count = metrics.get("transaction_count", 0)
-        fallback_cfg = self.skill_config.get("fallback_templates", {})
+        fallback_cfg = skill.fallback_templates
         financial_tpl = fallback_cfg.get(
             "financial_summary",
             "Total net revenue is IDR {total_revenue} from {transaction_count} successful transactions.",
@@ -235,10 +314,39 @@ class AgentRuntime:
     def _build_graph(self):
         graph = StateGraph(AgentState)
 
+        def deadline_passed(state: AgentState) -> bool:
+            return "deadline" in state and time.monotonic() >= state["deadline"]
+
+        def timed(name: str, node):
+            async def run_node(state: AgentState) -> AgentState:
+                if name != "fail" and not state.get("error") and deadline_passed(state):
+                    # Skip remaining work (including the LLM) once the deadline is gone.
+                    state["error"] = f"request deadline exceeded before {name}"
+                    state["cancelled"] = "deadline"
+                    return state
+                started = time.perf_counter()
+                try:
+                    return await node(state)
+                finally:
+                    state.setdefault("timings_ms", {})[name] = round((time.perf_counter() - started) * 1000, 2)
+                    # statement_timeout / DEADLINE_EXCEEDED errors surface as
+                    # ordinary tool failures; classify them by the clock.
+                    if state.get("error") and "cancelled" not in state and deadline_passed(state):
+                        state["cancelled"] = "deadline"
+
+            return run_node
+
         async def validate_input(state: AgentState) -> AgentState:
             payload = state["input"]
             if not payload.get("report_id") or not payload.get("merchant_id"):
                 state["error"] = "Missing report_id or merchant_id"
+                return state
+            # Resolve the skill once so a hot reload mid-run cannot mix versions.
+            skill = self.skills.get(payload.get("skill"))
+            if not skill:
+                state["error"] = f"unknown skill: {payload.get('skill') or self.skills.default_skill}"
+                return state
+            state["skill"] = skill
             return state
 
         async def validate_report_context(state: AgentState) -> AgentState:
@@ -249,6 +357,7 @@ class AgentRuntime:
             result = await self._mcp_call(
                 "get_report_context",
                 {"report_id": payload["report_id"]},
+                deadline=state["deadline"],
             )
             if not result.get("ok"):
                 state["error"] = f"get_report_context failed: {result.get('error', {}).get('message', 'unknown')}"
@@ -264,6 +373,29 @@ class AgentRuntime:
             state["context"] = context_data
             return state
 
+        async def claim_report(state: AgentState) -> AgentState:
+            if state.get("error"):
+                return state
+            payload = state["input"]
+            state["tool_calls_count"] = state.get("tool_calls_count", 0) + 1
+            result = await self._mcp_call(
+                "claim_report_run",
+                {
+                    "report_id": payload["report_id"],
+                    "claim_token": state["claim_token"],
+                    "lease_seconds": self.claim_lease_seconds,
+                    "idempotency_window_seconds": self.idempotency_ttl_seconds,
+                    "start_date": payload["start_date"],
+                    "end_date": payload["end_date"],
+                },
+                deadline=state["deadline"],
+            )
+            if not result.get("ok"):
+                state["error"] = f"claim_report_run failed: {result.get('error', {}).get('message', 'unknown')}"
+                return state
+            state["claim"] = result.get("data", {})
+            return state
+
         async def fetch_metrics(state: AgentState) -> AgentState:
             if state.get("error"):
                 return state
@@ -275,7 +407,10 @@ class AgentRuntime:
                     "merchant_id": payload["merchant_id"],
                     "start_date": payload["start_date"],
                     "end_date": payload["end_date"],
+                    "use_sketches": self.use_item_sketches,
+                    **self._query_budget(state),
                 },
+                deadline=state["deadline"],
             )
             if not result.get("ok"):
                 state["error"] = f"get_report_metrics failed: {result.get('error', {}).get('message', 'unknown')}"
@@ -287,27 +422,17 @@ class AgentRuntime:
             if state.get("error"):
                 return state
             payload = state["input"]
-            queries = self.skill_config.get("evidence_queries", [])
-            if not isinstance(queries, list) or len(queries) < 2:
-                state["error"] = "Skill config must provide at least 2 evidence_queries in SKILL.md"
-                return state
-
+            # Query configs are validated when the skill is loaded.
             evidence: dict[str, Any] = {}
-            for query_cfg in queries:
-                if not isinstance(query_cfg, dict):
-                    state["error"] = "Invalid evidence query config format"
-                    return state
-                key = str(query_cfg.get("name", "query"))
-                sql_template = str(query_cfg.get("sql", "")).strip()
-                if not sql_template:
-                    state["error"] = f"Missing SQL template for evidence query: {key}"
-                    return state
-                sql = self._render_sql_template(sql_template, payload)
+            for query_cfg in state["skill"].evidence_queries:
+                key = str(query_cfg["name"])
+                sql = self._render_sql_template(str(query_cfg["sql"]).strip(), payload)
                 limit = int(query_cfg.get("limit", 200))
                 state["tool_calls_count"] = state.get("tool_calls_count", 0) + 1
                 result = await self._mcp_call(
                     "run_read_query",
-                    {"sql": sql, "limit": limit},
+                    {"sql": sql, "limit": limit, **self._query_budget(state)},
+                    deadline=state["deadline"],
                 )
                 if not result.get("ok"):
                     state["error"] = f"run_read_query failed ({key}): {result.get('error', {}).get('message', 'unknown')}"
@@ -320,44 +445,50 @@ class AgentRuntime:
         async def draft_narratives(state: AgentState) -> AgentState:
             if state.get("error"):
                 return state
+            skill = state["skill"]
             metrics = state.get("metrics", {})
             evidence = state.get("evidence", {})
             if not self.llm:
-                state["narratives"] = self._fallback_narratives(metrics, evidence)
+                state["narratives"] = self._fallback_narratives(skill, metrics, evidence)
                 return state
 
-            prompt = ChatPromptTemplate.from_messages(
-                [
-                    (
-                        "system",
-                        "Follow these instructions strictly:\n"
-                        f"{self._escape_for_prompt_template(self.skill_text)}\n"
-                        "Return valid JSON with exactly these keys: financial_summary, pattern_analysis, strategic_advice.",
-                    ),
-                    ("human", "Metrics:\n{metrics}\n\nEvidence from run_read_query:\n{evidence}"),
-                ]
-            )
-            chain = prompt | self.llm
+            chain = skill.prompt | self.llm
+            prompt_input = {"metrics": metrics, "evidence": evidence}
+            estimated_tokens = (len(skill.text) + len(str(metrics)) + len(str(evidence))) // 4 + 1500
             try:
-                response = await chain.ainvoke({"metrics": metrics, "evidence": evidence})
+                response = await self.llm_gateway.invoke(
+                    lambda: chain.ainvoke(prompt_input),
+                    estimated_tokens=estimated_tokens,
+                    deadline=state["deadline"],
+                )
                 text = response.content if hasattr(response, "content") else str(response)
-                logger.info("LLM narrative raw output | text=%s", str(text))
+                log_event(
+                    logger,
+                    logging.INFO,
+                    "LLM narrative raw output",
+                    chars=len(str(text)),
+                    payload={"text": str(text)},
+                )
+            except LLMUnavailableError as exc:
+                logger.warning("LLM unavailable; using fallback template | reason=%s", str(exc))
+                state["narratives"] = self._fallback_narratives(skill, metrics, evidence)
+                return state
             except Exception as exc:
                 logger.error("LLM narrative generation failed | error=%s", str(exc))
-                state["narratives"] = self._fallback_narratives(metrics, evidence)
+                state["narratives"] = self._fallback_narratives(skill, metrics, evidence)
                 return state
 
-            parsed = self._extract_json_object(str(text))
+            parsed = extract_json_object(str(text))
 
             if not parsed:
                 logger.warning("LLM narrative parse failed; using fallback template")
-                state["narratives"] = self._fallback_narratives(metrics, evidence)
+                state["narratives"] = self._fallback_narratives(skill, metrics, evidence)
                 return state
 
             required = ["financial_summary", "pattern_analysis", "strategic_advice"]
             if not all(isinstance(parsed.get(k), str) and parsed.get(k).strip() for k in required):
                 logger.warning("LLM narrative missing required fields; using fallback template")
-                state["narratives"] = self._fallback_narratives(metrics, evidence)
+                state["narratives"] = self._fallback_narratives(skill, metrics, evidence)
                 return state
 
             state["narratives"] = {k: parsed[k].strip() for k in required}
@@ -369,11 +500,22 @@ class AgentRuntime:
             payload = state["input"]
             metrics = state["metrics"]
             narratives = state["narratives"]
+            # What the narratives were written from, kept for follow-up chat.
+            snapshot = {
+                "merchant_id": payload["merchant_id"],
+                "start_date": payload["start_date"],
+                "end_date": payload["end_date"],
+                "skill": state["skill"].name,
+                "metrics": metrics,
+                "evidence": state.get("evidence", {}),
+                "narratives": narratives,
+            }
             state["tool_calls_count"] = state.get("tool_calls_count", 0) + 1
             result = await self._mcp_call(
                 "update_report_staging",
                 {
                     "report_id": payload["report_id"],
+                    "claim_token": state.get("claim_token"),
                     "status": "READY",
                     "total_revenue": metrics.get("total_revenue"),
                     "transaction_count": metrics.get("transaction_count"),
@@ -382,40 +524,61 @@ class AgentRuntime:
                     "financial_summary": narratives.get("financial_summary"),
                     "pattern_analysis": narratives.get("pattern_analysis"),
                     "strategic_advice": narratives.get("strategic_advice"),
+                    "snapshot": snapshot,
                 },
+                deadline=state["deadline"],
             )
             if not result.get("ok"):
                 state["error"] = f"update_report_staging failed: {result.get('error', {}).get('message', 'unknown')}"
                 return state
+            if not result["data"].get("updated"):
+                state["error"] = "update_report_staging skipped: report claim was taken over by another run"
+                return state
             state["update_result"] = result["data"]
+            # Warm the chat cache so the first follow-up skips the snapshot fetch.
+            self.report_snapshots.put(payload["report_id"], ReportSnapshot.from_data(payload["report_id"], snapshot))
             return state
 
         async def mark_failed(state: AgentState) -> AgentState:
             error_text = state.get("error", "Unknown error")
             payload = state.get("input", {})
             report_id = payload.get("report_id", "")
-            if report_id:
+            if report_id and state.get("cancelled"):
+                state["tool_calls_count"] = state.get("tool_calls_count", 0) + 2
+                await self._abort_queries_and_mark(report_id, state["claim_token"], state["cancel_key"], error_text)
+            elif report_id:
                 state["tool_calls_count"] = state.get("tool_calls_count", 0) + 1
-                await self._mcp_call(
-                    "mark_report_failed",
-                    {"report_id": report_id, "reason": error_text},
-                )
+                fail_payload = {"report_id": report_id, "reason": error_text}
+                if state.get("claim", {}).get("claimed"):
+                    fail_payload["claim_token"] = state["claim_token"]
+                await self._mcp_call("mark_report_failed", fail_payload)
             return state
 
+        def route_after_claim(state: AgentState) -> str:
+            if state.get("error"):
+                return "fail"
+            return "run" if state.get("claim", {}).get("claimed") else "end"
+
         def route_after_write(state: AgentState) -> str:
             return "fail" if state.get("error") else "end"
 
-        graph.add_node("validate", validate_input)
-        graph.add_node("context", validate_report_context)
-        graph.add_node("metrics", fetch_metrics)
-        graph.add_node("evidence", fetch_evidence)
-        graph.add_node("narratives", draft_narratives)
-        graph.add_node("write_ready", write_ready)
-        graph.add_node("fail", mark_failed)
+        graph.add_node("validate", timed("validate", validate_input))
+        graph.add_node("context", timed("context", validate_report_context))
+        graph.add_node("claim", timed("claim", claim_report))
+        graph.add_node("metrics", timed("metrics", fetch_metrics))
+        graph.add_node("evidence", timed("evidence", fetch_evidence))
+        graph.add_node("narratives", timed("narratives", draft_narratives))
+        graph.add_node("write_ready", timed("write_ready", write_ready))
+        graph.add_node("fail", timed("fail", mark_failed))
 
         graph.set_entry_point("validate")
         graph.add_edge("validate", "context")
-        graph.add_edge("context", "metrics")
+        graph.add_edge("context", "claim")
+        graph.add_conditional_edges(
+            "claim",
+            route_after_claim,
+            {"fail": "fail", "run": "metrics", "end": END},
+        )
         graph.add_edge("metrics", "evidence")
         graph.add_edge("evidence", "narratives")
         graph.add_edge("narratives", "write_ready")
@@ -428,32 +591,399 @@ class AgentRuntime:
 
         return graph.compile()
 
+    def _new_claim_token(self) -> str:
+        return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+
+    def _cached_result(self, payload: dict[str, Any]) -> dict[str, Any] | None:
+        now = time.monotonic()
+        for report_id, (expires_at, _, _) in list(self._completed.items()):
+            if expires_at <= now:
+                self._completed.pop(report_id, None)
+        cached = self._completed.get(payload["report_id"])
+        if not cached or cached[1] != payload:
+            return None
+        return {**cached[2], "idempotent_replay": True}
+
+    async def _await_run(self, report_id: str, task: asyncio.Task) -> dict[str, Any]:
+        # Shielded so one disconnecting caller does not cancel a run that
+        # coalesced callers are still waiting on; the last caller to leave
+        # cancels it.
+        self._waiters[report_id] = self._waiters.get(report_id, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters.get(report_id) == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            self._waiters[report_id] -= 1
+            if not self._waiters[report_id]:
+                self._waiters.pop(report_id, None)
+
     async def run(self, request: ReportRequest) -> dict[str, Any]:
-        logger.info("Agent run start | request=%s", request.model_dump())
-        final_state = await self.graph.ainvoke({"input": request.model_dump(), "tool_calls_count": 0})
+        # The deadline belongs to the caller, not to the report's identity.
+        payload = request.model_dump(exclude={"deadline_seconds"})
+        cached = self._cached_result(payload)
+        if cached:
+            logger.info("Agent run replayed from idempotency cache | report_id=%s", request.report_id)
+            return cached
+
+        inflight = self._inflight.get(request.report_id)
+        if inflight:
+            inflight_payload, task = inflight
+            if inflight_payload != payload:
+                return {
+                    "ok": False,
+                    "error": "report_id is already running with different parameters",
+                    "error_code": "IN_PROGRESS",
+                    "report_id": request.report_id,
+                    "tool_calls_count": 0,
+                }
+            logger.info("Agent run coalesced onto in-flight run | report_id=%s", request.report_id)
+            # The follower's own deadline bounds its wait; the shared run keeps
+            # the leader's deadline and continues for the other callers.
+            try:
+                response = await asyncio.wait_for(
+                    self._await_run(request.report_id, task),
+                    request.deadline_seconds or self.request_deadline_seconds,
+                )
+            except asyncio.TimeoutError:
+                return {
+                    "ok": False,
+                    "error": "deadline exceeded while waiting for the in-flight run",
+                    "error_code": "DEADLINE_EXCEEDED",
+                    "report_id": request.report_id,
+                    "tool_calls_count": 0,
+                    "coalesced": True,
+                }
+            return {**response, "coalesced": True}
+
+        deadline_seconds = request.deadline_seconds or self.request_deadline_seconds
+        task = asyncio.create_task(self._run_graph(payload, time.monotonic() + deadline_seconds))
+        self._inflight[request.report_id] = (payload, task)
+        task.add_done_callback(lambda _: self._inflight.pop(request.report_id, None))
+        response = await self._await_run(request.report_id, task)
+        if response.get("ok") and self.idempotency_ttl_seconds > 0:
+            self._completed[request.report_id] = (
+                time.monotonic() + self.idempotency_ttl_seconds,
+                payload,
+                response,
+            )
+        return response
+
+    async def _run_graph(self, payload: dict[str, Any], deadline: float) -> dict[str, Any]:
+        report_id = payload["report_id"]
+        claim_token = self._new_claim_token()
+        cancel_key = uuid.uuid4().hex
+        log_event(logger, logging.INFO, "Agent run start", request=payload)
+        try:
+            final_state = await self.graph.ainvoke(
+                {
+                    "input": payload,
+                    "tool_calls_count": 0,
+                    "claim_token": claim_token,
+                    "cancel_key": cancel_key,
+                    "deadline": deadline,
+                }
+            )
+        except asyncio.CancelledError:
+            # Every caller disconnected: stop in-flight SQL and release the row.
+            self.cancelled_runs["client_disconnect"] += 1
+            logger.warning("Agent run cancelled; client disconnected | report_id=%s", report_id)
+            await asyncio.shield(
+                self._abort_queries_and_mark(report_id, claim_token, cancel_key, "client disconnected")
+            )
+            raise
         tool_calls = final_state.get("tool_calls_count", 0)
-        logger.info("Agent run state | report_id=%s | state=%s", request.report_id, final_state)
+        timings = final_state.get("timings_ms", {})
+        log_event(
+            logger,
+            logging.INFO,
+            "Agent run state",
+            report_id=report_id,
+            payload={"state": final_state},
+        )
+        claim = final_state.get("claim", {})
+        if claim and not claim.get("claimed") and not final_state.get("error"):
+            if claim.get("status") == "READY" and not claim.get("in_progress"):
+                # merchant_id was checked against staging in the context step.
+                stored_period = (claim.get("start_date"), claim.get("end_date"))
+                if stored_period != (payload["start_date"], payload["end_date"]):
+                    response = {
+                        "ok": False,
+                        "error": "report_id was recently generated for a different period",
+                        "error_code": "PARAMETER_MISMATCH",
+                        "report_id": report_id,
+                        "stored_period": {"start_date": stored_period[0], "end_date": stored_period[1]},
+                        "tool_calls_count": tool_calls,
+                        "timings_ms": timings,
+                    }
+                    log_event(logger, logging.WARNING, "Agent run rejected; replay parameters differ", response=response)
+                    return response
+                response = {
+                    "ok": True,
+                    "report_id": report_id,
+                    "result": {
+                        "updated": False,
+                        "report_id": report_id,
+                        "status": "READY",
+                        "generation_date": claim.get("generation_date"),
+                    },
+                    "tool_calls_count": tool_calls,
+                    "timings_ms": timings,
+                    "idempotent_replay": True,
+                }
+                log_event(logger, logging.INFO, "Agent run skipped; report recently completed", response=response)
+                return response
+            response = {
+                "ok": False,
+                "error": "report is already being generated by another agent run",
+                "error_code": "IN_PROGRESS",
+                "report_id": report_id,
+                "tool_calls_count": tool_calls,
+                "timings_ms": timings,
+            }
+            log_event(logger, logging.WARNING, "Agent run skipped; report claimed elsewhere", response=response)
+            return response
+        if final_state.get("cancelled"):
+            self.cancelled_runs[final_state["cancelled"]] += 1
+            response = {
+                "ok": False,
+                "error": final_state["error"],
+                "error_code": "DEADLINE_EXCEEDED",
+                "report_id": report_id,
+                "tool_calls_count": tool_calls,
+                "timings_ms": timings,
+            }
+            log_event(logger, logging.WARNING, "Agent run cancelled; deadline exceeded", response=response)
+            return response
         if final_state.get("error"):
             response = {
                 "ok": False,
                 "error": final_state["error"],
-                "report_id": request.report_id,
+                "report_id": report_id,
                 "tool_calls_count": tool_calls,
+                "timings_ms": timings,
             }
-            logger.error("Agent run failed | response=%s", response)
+            log_event(logger, logging.ERROR, "Agent run failed", response=response)
             return response
         response = {
             "ok": True,
-            "report_id": request.report_id,
+            "report_id": report_id,
             "result": final_state.get("update_result", {}),
             "tool_calls_count": tool_calls,
+            "timings_ms": timings,
+        }
+        log_event(logger, logging.INFO, "Agent run success", tool_calls_count=tool_calls, response=response)
+        return response
+
+    async def _write_chat_logs(self, turns: list[dict[str, Any]]) -> bool:
+        result = await self._mcp_call("append_chat_logs", {"turns": turns})
+        error = result.get("error") or {}
+        if error.get("code") == "VALIDATION_ERROR":
+            raise ChatLogRejected(error.get("message", "invalid chat log batch"))
+        return bool(result.get("ok"))
+
+    def _fallback_chat_answer(self, snapshot: ReportSnapshot) -> str:
+        metrics = snapshot.data.get("metrics", {})
+        answer = (
+            f"Automatic answers are unavailable right now. For {snapshot.start_date} to {snapshot.end_date}, "
+            f"total net revenue was IDR {metrics.get('total_revenue', 0):,.2f} from "
+            f"{metrics.get('transaction_count', 0)} successful transactions; the top item was "
+            f"{metrics.get('top_selling_item_name', 'N/A')} ({metrics.get('top_selling_item_qty', 0)} units)."
+        )
+        summary = snapshot.data.get("narratives", {}).get("financial_summary")
+        return f"{answer} {summary}" if summary else answer
+
+    async def _chat_llm(self, messages: list[Any], deadline: float) -> dict[str, Any] | None:
+        estimated_tokens = sum(len(str(message.content)) for message in messages) // 4 + 500
+        try:
+            response = await self.llm_gateway.invoke(
+                lambda: self.llm.ainvoke(messages),
+                estimated_tokens=estimated_tokens,
+                deadline=deadline,
+            )
+        except LLMUnavailableError as exc:
+            logger.warning("LLM unavailable; using fallback chat answer | reason=%s", str(exc))
+            return None
+        except Exception as exc:
+            logger.error("LLM chat answer failed | error=%s", str(exc))
+            return None
+        text = response.content if hasattr(response, "content") else str(response)
+        parsed = extract_json_object(str(text))
+        if not parsed:
+            logger.warning("LLM chat answer parse failed; using fallback answer")
+        return parsed
+
+    async def _load_snapshot(
+        self,
+        request: ChatRequest,
+        session: ChatSession | None,
+        deadline: float,
+    ) -> tuple[ReportSnapshot | None, list[dict[str, Any]] | None, dict[str, Any] | None]:
+        # Returns (snapshot, stored history, error response). The MCP call is
+        # skipped when both the snapshot and the chat session are cached.
+        snapshot = self.report_snapshots.get(request.report_id)
+        need_history = bool(request.chat_id) and session is None
+        if snapshot and not need_history:
+            return snapshot, None, None
+        args: dict[str, Any] = {"report_id": request.report_id, "history_limit": 0}
+        if need_history:
+            args.update({"chat_id": request.chat_id, "history_limit": self.chat_history_messages})
+        result = await self._mcp_call("get_report_snapshot", args, deadline=deadline)
+        if not result.get("ok"):
+            error = result.get("error") or {}
+            message = f"get_report_snapshot failed: {error.get('message', 'unknown')}"
+            failure = {"ok": False, "error": message}
+            if error.get("code") == "DEADLINE_EXCEEDED":
+                failure["error_code"] = "DEADLINE_EXCEEDED"
+            return None, None, failure
+        data = result.get("data", {})
+        if not data.get("found"):
+            return None, None, {
+                "ok": False,
+                "error": f"report snapshot not found: {request.report_id}",
+                "error_code": "NOT_FOUND",
+            }
+        if snapshot is None:
+            snapshot = ReportSnapshot.from_data(request.report_id, data)
+            self.report_snapshots.put(request.report_id, snapshot)
+        if data.get("chat_conflict"):
+            return None, None, {
+                "ok": False,
+                "error": "chat_id belongs to a different report",
+                "error_code": "INVALID_CHAT",
+            }
+        return snapshot, data.get("history", []), None
+
+    async def chat(self, request: ChatRequest) -> dict[str, Any]:
+        started = time.perf_counter()
+        # One budget for the whole turn: snapshot fetch, query and LLM calls.
+        deadline = time.monotonic() + (request.deadline_seconds or self.chat_deadline_seconds)
+        asked_at = datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
+        timings: dict[str, float] = {}
+        tool_calls = 0
+
+        session = self.chat_sessions.get(request.chat_id) if request.chat_id else None
+        if session and session.report_id != request.report_id:
+            return {
+                "ok": False,
+                "error": "chat_id belongs to a different report",
+                "error_code": "INVALID_CHAT",
+                "report_id": request.report_id,
+                "tool_calls_count": tool_calls,
+            }
+        snapshot, stored_history, error = await self._load_snapshot(request, session, deadline)
+        if stored_history is not None or error:
+            tool_calls += 1
+        timings["snapshot"] = round((time.perf_counter() - started) * 1000, 2)
+        if error:
+            return {**error, "report_id": request.report_id, "tool_calls_count": tool_calls, "timings_ms": timings}
+        if snapshot.merchant_id != request.merchant_id:
+            return {
+                "ok": False,
+                "error": "merchant_id mismatch between request and report",
+                "error_code": "FORBIDDEN",
+                "report_id": request.report_id,
+                "tool_calls_count": tool_calls,
+            }
+
+        chat_id = request.chat_id or str(uuid.uuid4())
+        if session is None:
+            session = ChatSession(
+                chat_id=chat_id,
+                report_id=request.report_id,
+                merchant_id=request.merchant_id,
+                turns=deque(
+                    ({"role": turn["role"], "content": turn["content"]} for turn in stored_history or []),
+                    maxlen=self.chat_history_messages,
+                ),
+            )
+
+        source = "snapshot"
+        answer = None
+        if self.llm:
+            llm_started = time.perf_counter()
+            messages = build_messages(snapshot, list(session.turns), request.question)
+            reply = await self._chat_llm(messages, deadline)
+            query = (reply or {}).get("query")
+            if isinstance(query, dict) and query.get("name"):
+                # The snapshot was not enough: fetch only what the question
+                # needs, with a fixed query scoped to the request's merchant.
+                tool_calls += 1
+                query_started = time.perf_counter()
+                cancel_key = uuid.uuid4().hex
+                result = await self._mcp_call(
+                    "run_chat_query",
+                    {
+                        "merchant_id": request.merchant_id,
+                        "query_name": str(query["name"]),
+                        "start_date": str(query.get("start_date") or snapshot.start_date),
+                        "end_date": str(query.get("end_date") or snapshot.end_date),
+                        "limit": self.chat_query_limit,
+                        "timeout_ms": max(1, int((deadline - time.monotonic()) * 1000)),
+                        "cancel_key": cancel_key,
+                    },
+                    deadline=deadline,
+                )
+                if (result.get("error") or {}).get("code") == "DEADLINE_EXCEEDED":
+                    await self._mcp_call(
+                        "cancel_queries",
+                        {"cancel_key": cancel_key},
+                        deadline=time.monotonic() + self.cancel_cleanup_seconds,
+                    )
+                timings["query"] = round((time.perf_counter() - query_started) * 1000, 2)
+                query_result = result.get("data") if result.get("ok") else {"error": result.get("error")}
+                messages += [
+                    AIMessage(content=dumps_text(reply)),
+                    HumanMessage(content=QUERY_RESULT_PROMPT.format(result=dumps_text(query_result))),
+                ]
+                reply = await self._chat_llm(messages, deadline)
+                source = "query"
+            answer = str((reply or {}).get("answer") or "").strip() or None
+            timings["llm"] = round((time.perf_counter() - llm_started) * 1000 - timings.get("query", 0), 2)
+        if not answer:
+            answer = self._fallback_chat_answer(snapshot)
+            source = "fallback"
+
+        session.turns.extend(
+            [{"role": "user", "content": request.question}, {"role": "assistant", "content": answer}]
+        )
+        self.chat_sessions.put(chat_id, session)
+        answered_at = datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
+        self.chat_logs.append(
+            [
+                {
+                    "log_id": str(uuid.uuid4()),
+                    "chat_id": chat_id,
+                    "merchant_id": request.merchant_id,
+                    "report_id": request.report_id,
+                    "role": role,
+                    "content": content,
+                    "created_at": created_at,
+                }
+                for role, content, created_at in (
+                    ("user", request.question, asked_at),
+                    ("assistant", answer, answered_at),
+                )
+            ]
+        )
+        timings["total"] = round((time.perf_counter() - started) * 1000, 2)
+        response = {
+            "ok": True,
+            "chat_id": chat_id,
+            "report_id": request.report_id,
+            "answer": answer,
+            "source": source,
+            "tool_calls_count": tool_calls,
+            "timings_ms": timings,
         }
-        logger.info("Agent run success | tool_calls_count=%s | response=%s", tool_calls, response)
+        log_event(logger, logging.INFO, "Chat answered", chat_id=chat_id, source=source, timings_ms=timings)
         return response
 
 
 runtime = AgentRuntime()
-app = FastAPI(title="Reporting Agent", version="0.1.0")
+app = FastAPI(title="Reporting Agent", version="0.1.0", default_response_class=ORJSONResponse)
 
 
 @app.on_event("startup")
@@ -461,15 +991,73 @@ async def _startup() -> None:
     await runtime.startup()
 
 
+@app.on_event("shutdown")
+async def _shutdown() -> None:
+    await runtime.chat_logs.stop()
+    shutdown_logging()
+
+
 @app.get("/health")
 async def health() -> dict[str, Any]:
-    return {"ok": True, "tools_loaded": len(runtime.tools)}
+    return {
+        "ok": True,
+        "tools_loaded": len(runtime.tools),
+        "inflight_reports": len(runtime._inflight),
+        "cancelled_runs": runtime.cancelled_runs,
+        "llm_gateway": runtime.llm_gateway.stats(),
+        "skills": runtime.skills.stats(),
+        "chat": {
+            "cached_snapshots": len(runtime.report_snapshots),
+            "cached_sessions": len(runtime.chat_sessions),
+            "logs": runtime.chat_logs.stats(),
+        },
+        "logging": logging_stats(),
+    }
+
+
+async def _wait_for_disconnect(request: Request) -> None:
+    interval = float(os.getenv("AGENT_DISCONNECT_POLL_SECONDS", "0.5"))
+    while not await request.is_disconnected():
+        await asyncio.sleep(interval)
 
 
 @app.post("/generate-report")
-async def generate_report(payload: ReportRequest) -> dict[str, Any]:
-    logger.info("HTTP /generate-report called | payload=%s", payload.model_dump())
-    result = await runtime.run(payload)
+async def generate_report(payload: ReportRequest, request: Request) -> Any:
+    log_event(logger, logging.INFO, "HTTP /generate-report called", request=payload.model_dump())
+    run_task = asyncio.create_task(runtime.run(payload))
+    disconnect_task = asyncio.create_task(_wait_for_disconnect(request))
+    try:
+        await asyncio.wait({run_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        disconnect_task.cancel()
+        if not run_task.done():
+            # Client went away (or the server is stopping): cancel the graph
+            # unless other callers share the run.
+            run_task.cancel()
+    if not run_task.done() or run_task.cancelled():
+        with contextlib.suppress(asyncio.CancelledError):
+            await run_task
+        log_event(logger, logging.WARNING, "HTTP /generate-report client disconnected", report_id=payload.report_id)
+        return ORJSONResponse(
+            status_code=499,
+            content={"ok": False, "error": "client disconnected", "error_code": "CLIENT_DISCONNECTED"},
+        )
+    result = run_task.result()
+    if not result.get("ok"):
+        status_code = {"IN_PROGRESS": 409, "PARAMETER_MISMATCH": 409, "DEADLINE_EXCEEDED": 504}.get(
+            result.get("error_code"), 500
+        )
+        raise HTTPException(status_code=status_code, detail=result)
+    return result
+
+
+@app.post("/chat")
+async def chat(payload: ChatRequest) -> dict[str, Any]:
+    log_event(logger, logging.INFO, "HTTP /chat called", request=payload.model_dump())
+    result = await runtime.chat(payload)
     if not result.get("ok"):
-        raise HTTPException(status_code=500, detail=result)
+        status_code = {"NOT_FOUND": 404, "FORBIDDEN": 403, "INVALID_CHAT": 409, "DEADLINE_EXCEEDED": 504}.get(
+            result.get("error_code"), 500
+        )
+        raise HTTPException(status_code=status_code, detail=result)
     return result
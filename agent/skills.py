@@ -0,0 +1,179 @@
+import logging
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from langchain_core.prompts import ChatPromptTemplate
+
+from shared.codec import loads
+
+
+logger = logging.getLogger("paylabs-agent.skills")
+
+NARRATIVE_KEYS = ("financial_summary", "pattern_analysis", "strategic_advice")
+
+_CONFIG_BLOCK = re.compile(r"```json\s*(\{[\s\S]*?\})\s*```")
+_FRONTMATTER = re.compile(r"\A---\s*\n([\s\S]*?)\n---")
+_FRONTMATTER_NAME = re.compile(r"^name:\s*(\S+)\s*$", re.MULTILINE)
+
+
+class SkillConfigError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class CompiledSkill:
+    name: str
+    path: Path
+    mtime_ns: int
+    text: str = field(repr=False)
+    config: dict[str, Any] = field(repr=False)
+    prompt: ChatPromptTemplate = field(repr=False)
+
+    @property
+    def evidence_queries(self) -> list[dict[str, Any]]:
+        return self.config["evidence_queries"]
+
+    @property
+    def fallback_templates(self) -> dict[str, str]:
+        return self.config.get("fallback_templates", {})
+
+
+def _escape_for_prompt_template(text: str) -> str:
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+def extract_skill_config(skill_text: str) -> dict[str, Any]:
+    for raw in _CONFIG_BLOCK.findall(skill_text):
+        try:
+            parsed = loads(raw)
+        except ValueError:
+            continue
+        if isinstance(parsed, dict) and "evidence_queries" in parsed:
+            return parsed
+    raise SkillConfigError("no ```json config block with evidence_queries found")
+
+
+def validate_skill_config(config: dict[str, Any]) -> dict[str, Any]:
+    queries = config.get("evidence_queries")
+    if not isinstance(queries, list) or len(queries) < 2:
+        raise SkillConfigError("evidence_queries must be a list with at least 2 queries")
+    seen: set[str] = set()
+    for index, query_cfg in enumerate(queries):
+        if not isinstance(query_cfg, dict):
+            raise SkillConfigError(f"evidence_queries[{index}] must be an object")
+        name = str(query_cfg.get("name", "")).strip()
+        if not name:
+            raise SkillConfigError(f"evidence_queries[{index}] is missing a name")
+        if name in seen:
+            raise SkillConfigError(f"duplicate evidence query name: {name}")
+        seen.add(name)
+        if not str(query_cfg.get("sql", "")).strip():
+            raise SkillConfigError(f"Missing SQL template for evidence query: {name}")
+        limit = query_cfg.get("limit", 200)
+        if not isinstance(limit, int) or not 1 <= limit <= 1000:
+            raise SkillConfigError(f"evidence query {name}: limit must be an integer between 1 and 1000")
+    templates = config.get("fallback_templates", {})
+    if not isinstance(templates, dict) or not all(isinstance(v, str) for v in templates.values()):
+        raise SkillConfigError("fallback_templates must map narrative keys to strings")
+    unknown = set(templates) - set(NARRATIVE_KEYS)
+    if unknown:
+        raise SkillConfigError(f"unknown fallback_templates keys: {sorted(unknown)}")
+    return config
+
+
+def compile_prompt(skill_text: str) -> ChatPromptTemplate:
+    # The system message depends only on the skill file so its bytes stay
+    # identical across requests, which keeps provider-side prompt caching warm.
+    return ChatPromptTemplate.from_messages(
+        [
+            (
+                "system",
+                "Follow these instructions strictly:\n"
+                f"{_escape_for_prompt_template(skill_text)}\n"
+                "Return valid JSON with exactly these keys: financial_summary, pattern_analysis, strategic_advice.",
+            ),
+            ("human", "Metrics:\n{metrics}\n\nEvidence from run_read_query:\n{evidence}"),
+        ]
+    )
+
+
+def load_skill(path: Path, default_name: str) -> CompiledSkill:
+    mtime_ns = path.stat().st_mtime_ns
+    text = path.read_text(encoding="utf-8")
+    frontmatter = _FRONTMATTER.match(text.lstrip("\ufeff"))
+    match = _FRONTMATTER_NAME.search(frontmatter.group(1)) if frontmatter else None
+    name = match.group(1) if match else default_name
+    config = validate_skill_config(extract_skill_config(text))
+    return CompiledSkill(
+        name=name,
+        path=path,
+        mtime_ns=mtime_ns,
+        text=text,
+        config=config,
+        prompt=compile_prompt(text),
+    )
+
+
+class SkillRegistry:
+    def __init__(self, root: Path, default_skill: str, reload_interval_seconds: float = 2.0) -> None:
+        self.root = root
+        self.default_skill = default_skill
+        self.reload_interval_seconds = reload_interval_seconds
+        self._skills: dict[str, CompiledSkill] = {}
+        self._errors: dict[str, str] = {}
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.refresh(force=True)
+
+    def _skill_files(self) -> list[Path]:
+        if not self.root.is_dir():
+            return []
+        return sorted(self.root.glob("*/SKILL.md"))
+
+    def refresh(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.reload_interval_seconds:
+            return
+        with self._lock:
+            self._checked_at = now
+            by_path = {skill.path: skill for skill in self._skills.values()}
+            skills: dict[str, CompiledSkill] = {}
+            for path in self._skill_files():
+                current = by_path.get(path)
+                try:
+                    if current and path.stat().st_mtime_ns == current.mtime_ns:
+                        skills[current.name] = current
+                        continue
+                    skill = load_skill(path, default_name=path.parent.name)
+                except (OSError, SkillConfigError) as exc:
+                    # Keep serving the last good version of a skill whose file
+                    # is mid-edit or invalid.
+                    if self._errors.get(str(path)) != str(exc):
+                        logger.error("Skill load failed | path=%s | error=%s", path, exc)
+                    self._errors[str(path)] = str(exc)
+                    if current:
+                        skills[current.name] = current
+                    continue
+                self._errors.pop(str(path), None)
+                if current:
+                    logger.info("Skill reloaded | name=%s | path=%s", skill.name, path)
+                skills[skill.name] = skill
+            self._skills = skills
+
+    def get(self, name: str | None = None) -> CompiledSkill | None:
+        self.refresh()
+        return self._skills.get(name or self.default_skill)
+
+    def names(self) -> list[str]:
+        return sorted(self._skills)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "default": self.default_skill,
+            "loaded": self.names(),
+            "errors": dict(self._errors),
+        }
@@ -0,0 +1,233 @@
+"""Microbenchmark: JSON encode/decode cost per generated report.
+
+Compares the previous path (per-value ``_json_safe`` + stdlib ``json`` in the
+MCP server, list-of-blocks re-parsing in ``_mcp_call`` and up to three parses in
+``_extract_json_object``) with ``shared.codec`` on payloads shaped like the real
+``get_report_metrics`` and evidence query results.
+
+Run from the repository root:
+
+    python benchmarks/bench_codec.py
+"""
+
+import json
+import random
+import re
+import sys
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from shared import codec  # noqa: E402
+
+
+# ---------------------------------------------------------------------------
+# Realistic payloads (one report = context + metrics + 4 evidence + update)
+# ---------------------------------------------------------------------------
+
+def _money(rng: random.Random, low: int, high: int) -> Decimal:
+    return Decimal(rng.randint(low * 100, high * 100)) / Decimal(100)
+
+
+def build_evidence_rows(days: int, seed: int = 42) -> dict[str, list[tuple[list[str], list[tuple]]]]:
+    rng = random.Random(seed)
+    start = date(2026, 1, 1)
+    daily = [
+        (start + timedelta(days=i), _money(rng, 20_000, 900_000), rng.randint(1, 12))
+        for i in range(min(days, 200))
+    ]
+    hourly = [(h, rng.randint(1, 60), _money(rng, 50_000, 2_000_000)) for h in range(24)]
+    payment = [
+        (m, rng.randint(10, 300), _money(rng, 500_000, 9_000_000))
+        for m in ["QRIS", "VA_BCA", "E_WALLET_OVO", "E_WALLET_DANA", "CARD"]
+    ]
+    categories = [
+        (c, rng.randint(10, 900), _money(rng, 100_000, 20_000_000))
+        for c in ["Grocery", "Fruit", "Beverage", "Snack", "Dairy", "Household", "Digital", "Health", "CNY"]
+    ]
+    return {
+        "daily_trend": (["day", "revenue", "tx_count"], daily),
+        "hourly_pattern": (["hour_of_day", "tx_count", "revenue"], hourly),
+        "payment_mix": (["payment_method", "tx_count", "revenue"], payment),
+        "category_performance": (["category", "total_qty", "estimated_revenue"], categories),
+    }
+
+
+METRICS = {
+    "merchant_id": "01",
+    "start_date": "2026-01-01",
+    "end_date": "2026-03-31",
+    "total_revenue": 18_234_551.25,
+    "transaction_count": 412,
+    "top_selling_item_name": "Beras 5kg",
+    "top_selling_item_qty": 96,
+    "peak_sales_hour": "18:00-19:00",
+    "payment_method_breakdown": [
+        {"payment_method": m, "transaction_count": n}
+        for m, n in [("QRIS", 140), ("VA_BCA", 90), ("E_WALLET_OVO", 80), ("E_WALLET_DANA", 60), ("CARD", 42)]
+    ],
+    "previous_period_start": "2025-10-02",
+    "previous_period_end": "2025-12-31",
+    "previous_period_revenue": 15_002_000.0,
+    "revenue_change_pct": 21.55,
+}
+
+SMALL_RESULTS = [
+    {"found": True, "report_id": "q1-2026", "merchant_id": "01",
+     "generation_date": datetime(2026, 4, 1, 9, 0, 0), "status": "PROCESSING"},
+    {"updated": True, "report_id": "q1-2026", "status": "READY",
+     "generation_date": datetime(2026, 4, 1, 9, 1, 12, 123456)},
+]
+
+LLM_REPLY = (
+    "Here is the report:\n```json\n"
+    + json.dumps(
+        {
+            "financial_summary": "Revenue grew strongly across the quarter. " * 8,
+            "pattern_analysis": "Evening demand dominates, led by QRIS payments. " * 8,
+            "strategic_advice": "Stock up on staples before the weekend peak. " * 8,
+        }
+    )
+    + "\n```\nLet me know if you need more detail."
+)
+
+
+# ---------------------------------------------------------------------------
+# Previous implementation (kept here verbatim-in-spirit as the baseline)
+# ---------------------------------------------------------------------------
+
+def _json_safe(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def old_server_encode_rows(columns, rows) -> str:
+    data_rows = [{k: _json_safe(v) for k, v in zip(columns, row)} for row in rows]
+    result = {"ok": True, "data": {"row_count": len(data_rows), "limit": 200, "columns": columns, "rows": data_rows}, "error": None}
+    # Framework path: indented text content plus the structured content copy.
+    text = json.dumps(result, indent=2, default=str)
+    json.dumps(result, default=str)
+    return text
+
+
+def old_server_encode(result) -> str:
+    text = json.dumps(result, indent=2, default=str)
+    json.dumps(result, default=str)
+    return text
+
+
+def old_agent_parse(result):
+    if isinstance(result, dict):
+        return result
+    if isinstance(result, str):
+        try:
+            parsed = json.loads(result)
+            if isinstance(parsed, dict):
+                return parsed
+        except json.JSONDecodeError:
+            pass
+    if isinstance(result, list):
+        for item in result:
+            if isinstance(item, dict):
+                text = item.get("text")
+                if isinstance(text, str):
+                    try:
+                        parsed = json.loads(text)
+                        if isinstance(parsed, dict):
+                            return parsed
+                    except json.JSONDecodeError:
+                        continue
+    return None
+
+
+def old_extract_json_object(text):
+    content = text.strip()
+    try:
+        parsed = json.loads(content)
+        if isinstance(parsed, dict):
+            return parsed
+    except json.JSONDecodeError:
+        pass
+    fence_match = re.search(r"```(?:json)?\s*(\{[\s\S]*?\})\s*```", content)
+    if fence_match:
+        try:
+            parsed = json.loads(fence_match.group(1))
+            if isinstance(parsed, dict):
+                return parsed
+        except json.JSONDecodeError:
+            pass
+    first_brace = content.find("{")
+    last_brace = content.rfind("}")
+    if first_brace != -1 and last_brace > first_brace:
+        try:
+            parsed = json.loads(content[first_brace : last_brace + 1])
+            if isinstance(parsed, dict):
+                return parsed
+        except json.JSONDecodeError:
+            pass
+    return None
+
+
+# ---------------------------------------------------------------------------
+# One report, end to end, for each path
+# ---------------------------------------------------------------------------
+
+def _blocks(text: str) -> list[dict]:
+    # langchain-mcp-adapters content block list as seen by _mcp_call
+    return [{"type": "text", "text": text}]
+
+
+def old_report(evidence) -> None:
+    wire = [old_server_encode({"ok": True, "data": METRICS, "error": None})]
+    wire += [old_server_encode({"ok": True, "data": r, "error": None}) for r in SMALL_RESULTS]
+    wire += [old_server_encode_rows(cols, rows) for cols, rows in evidence.values()]
+    for text in wire:
+        old_agent_parse(_blocks(text))
+    old_extract_json_object(LLM_REPLY)
+
+
+def new_report(evidence) -> None:
+    wire = [codec.dumps_text({"ok": True, "data": METRICS, "error": None})]
+    wire += [codec.dumps_text({"ok": True, "data": r, "error": None}) for r in SMALL_RESULTS]
+    wire += [
+        codec.dumps_text(
+            {"ok": True, "data": {"row_count": len(rows), "limit": 200, "columns": cols,
+                                  "rows": [dict(zip(cols, row)) for row in rows]}, "error": None}
+        )
+        for cols, rows in evidence.values()
+    ]
+    for text in wire:
+        codec.parse_tool_result(_blocks(text))
+    codec.extract_json_object(LLM_REPLY)
+
+
+def bench(fn, *args, repeat: int = 5, number: int = 200) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.process_time()
+        for _ in range(number):
+            fn(*args)
+        best = min(best, (time.process_time() - started) / number)
+    return best
+
+
+def main() -> None:
+    backend = "orjson" if codec.orjson is not None else "stdlib json (orjson not installed)"
+    print(f"codec backend: {backend}")
+    print(f"{'window':>8} {'old us/report':>14} {'new us/report':>14} {'saved us':>10} {'speedup':>8}")
+    for label, days in [("month", 31), ("quarter", 90), ("year", 365)]:
+        evidence = build_evidence_rows(days)
+        assert old_extract_json_object(LLM_REPLY) == codec.extract_json_object(LLM_REPLY)
+        old = bench(old_report, evidence) * 1e6
+        new = bench(new_report, evidence) * 1e6
+        print(f"{label:>8} {old:14.1f} {new:14.1f} {old - new:10.1f} {old / new:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
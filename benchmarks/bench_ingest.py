@@ -0,0 +1,133 @@
+"""Sustained ingestion benchmark for the ``ingest_transactions`` MCP tool.
+
+Streams synthetic batches (transactions + items) through the tool's binary
+COPY + merge path for a fixed duration while a reader thread keeps calling
+``get_report_metrics``, then reports sustained rows/sec and the reporting-read
+latency observed under that write load.
+
+Requires a running Postgres initialised with ``init.sql`` and the MCP server
+dependencies installed. Run from the repository root, e.g.:
+
+    DB_HOST=localhost DB_PORT=54321 DB_NAME=paylabs_db \\
+    DB_READ_USER=mcp_read DB_READ_PASSWORD=... \\
+    DB_WRITE_USER=mcp_write DB_WRITE_PASSWORD=... \\
+    python benchmarks/bench_ingest.py --seconds 30 --batch-size 1000 --writers 2
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "mcp-server"))
+
+import app  # noqa: E402
+
+
+ITEMS = [
+    ("Beras 5kg", "Grocery", 65000),
+    ("Gula 1kg", "Grocery", 18000),
+    ("Telur Ayam 1kg", "Grocery", 30000),
+    ("Kopi Sachet", "Beverage", 2500),
+    ("Teh Botol", "Beverage", 6000),
+    ("Biskuit", "Snack", 12000),
+    ("Susu UHT 1L", "Dairy", 20000),
+    ("Sabun Mandi", "Household", 8000),
+]
+PAYMENT_METHODS = ["QRIS", "VA_BCA", "E_WALLET_OVO", "E_WALLET_DANA", "CARD"]
+
+
+def build_batch(rng: random.Random, merchant_id: str, size: int, day: datetime) -> list[dict]:
+    batch = []
+    for _ in range(size):
+        items = [
+            {"item_name": name, "category": category, "quantity": rng.randint(1, 5), "unit_price": price}
+            for name, category, price in rng.sample(ITEMS, rng.randint(1, 3))
+        ]
+        gross = sum(item["quantity"] * item["unit_price"] for item in items)
+        fee = round(gross * 0.01, 2)
+        batch.append(
+            {
+                "transaction_id": str(uuid.uuid4()),
+                "merchant_id": merchant_id,
+                "gross_amount": gross,
+                "fee_deducted": fee,
+                "net_amount": round(gross - fee, 2),
+                "status": "SUCCESS",
+                "payment_method": rng.choice(PAYMENT_METHODS),
+                "created_at": (day + timedelta(seconds=rng.randint(0, 86399))).isoformat(),
+                "items": items,
+            }
+        )
+    return batch
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=30.0)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--merchant-id", default="01")
+    parser.add_argument("--day", default="2026-03-01")
+    args = parser.parse_args()
+
+    day = datetime.fromisoformat(args.day)
+    deadline = time.monotonic() + args.seconds
+    lock = threading.Lock()
+    totals = {"transactions": 0, "items": 0, "batches": 0, "errors": 0}
+    batch_latencies: list[float] = []
+    read_latencies: list[float] = []
+
+    def writer(seed: int) -> None:
+        rng = random.Random(seed)
+        while time.monotonic() < deadline:
+            batch = build_batch(rng, args.merchant_id, args.batch_size, day)
+            started = time.perf_counter()
+            result = app.ingest_transactions(batch)
+            elapsed = time.perf_counter() - started
+            with lock:
+                batch_latencies.append(elapsed)
+                if not result["ok"]:
+                    totals["errors"] += 1
+                    print("ingest error:", result["error"], file=sys.stderr)
+                    continue
+                totals["transactions"] += result["data"]["inserted_transactions"]
+                totals["items"] += result["data"]["inserted_items"]
+                totals["batches"] += 1
+
+    def reader() -> None:
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            app.get_report_metrics(args.merchant_id, "2026-01-01", args.day)
+            read_latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=writer, args=(seed,)) for seed in range(args.writers)]
+    threads.append(threading.Thread(target=reader))
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    rows = totals["transactions"] + totals["items"]
+    print(f"duration_s          {elapsed:.1f}")
+    print(f"batches             {totals['batches']} (errors {totals['errors']})")
+    print(f"transactions/s      {totals['transactions'] / elapsed:,.0f}")
+    print(f"rows/s (tx + items) {rows / elapsed:,.0f}")
+    if batch_latencies:
+        print(f"batch p50/max ms    {statistics.median(batch_latencies) * 1000:.1f} / {max(batch_latencies) * 1000:.1f}")
+    if len(read_latencies) >= 2:
+        q = statistics.quantiles(read_latencies, n=100)
+        print(f"metrics read p50/p95 ms {q[49] * 1000:.1f} / {q[94] * 1000:.1f} ({len(read_latencies)} reads)")
+
+
+if __name__ == "__main__":
+    main()
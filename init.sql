@@ -38,6 +38,7 @@ CREATE TABLE chat_logs (
     log_id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
     chat_id UUID NOT NULL,
     merchant_id TEXT REFERENCES merchants(merchant_id) ON DELETE CASCADE,
+    report_id TEXT,
     role VARCHAR(50) NOT NULL CHECK (role IN ('user', 'assistant')),
     content TEXT NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
@@ -49,14 +50,18 @@ CREATE TABLE report_generation_staging (
     report_id TEXT PRIMARY KEY,
     merchant_id TEXT,
     generation_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    status VARCHAR(50) NOT NULL DEFAULT 'PROCESSING', -- PROCESSING, READY, FAILED
+    status VARCHAR(50) NOT NULL DEFAULT 'PROCESSING', -- PROCESSING, READY, FAILED, CANCELLED
     total_revenue DECIMAL(15, 2),
     transaction_count INTEGER,
     top_selling_item_name VARCHAR(255),
     top_selling_item_qty INTEGER,
     financial_summary TEXT,
     pattern_analysis TEXT,
-    strategic_advice TEXT
+    strategic_advice TEXT,
+    claim_token TEXT, -- agent run currently holding the report (NULL when idle)
+    claimed_at TIMESTAMP,
+    period_start DATE, -- report period of the last claimed run
+    period_end DATE
 );
 
 -- Table 6: report_history
@@ -74,6 +79,41 @@ CREATE TABLE report_history (
     strategic_advice TEXT
 );
 
+-- Table 7: item_daily_sketches
+-- Per-merchant, per-day Space-Saving top-k summaries of SUCCESS item quantities
+-- (dimension 'item' or 'category'). counters = {"key": [count, error]}.
+CREATE TABLE item_daily_sketches (
+    merchant_id TEXT REFERENCES merchants(merchant_id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    dimension VARCHAR(20) NOT NULL CHECK (dimension IN ('item', 'category')),
+    capacity INTEGER NOT NULL,
+    counters JSONB NOT NULL DEFAULT '{}'::jsonb,
+    total BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (merchant_id, day, dimension)
+);
+
+-- Table 8: report_snapshots
+-- Metrics + evidence the narratives were generated from, kept for follow-up chat.
+CREATE TABLE report_snapshots (
+    report_id TEXT PRIMARY KEY,
+    merchant_id TEXT REFERENCES merchants(merchant_id) ON DELETE CASCADE,
+    start_date DATE NOT NULL,
+    end_date DATE NOT NULL,
+    skill TEXT,
+    metrics JSONB NOT NULL,
+    evidence JSONB NOT NULL,
+    narratives JSONB NOT NULL DEFAULT '{}'::jsonb,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Keyset order used by the /export/reports stream
+CREATE INDEX idx_report_staging_export ON report_generation_staging (status, generation_date, report_id);
+CREATE INDEX idx_report_history_export ON report_history (status, generation_date, report_id);
+
+-- Recent turns of a chat for follow-up questions
+CREATE INDEX idx_chat_logs_chat ON chat_logs (chat_id, created_at);
+
 -- MCP database roles
 DO $$
 BEGIN
@@ -93,6 +133,10 @@ ALTER DEFAULT PRIVILEGES IN SCHEMA public GRANT SELECT ON TABLES TO mcp_read;
 
 GRANT SELECT ON merchants, transactions, transaction_items, report_generation_staging TO mcp_write;
 GRANT UPDATE ON report_generation_staging TO mcp_write;
+GRANT INSERT ON transactions, transaction_items TO mcp_write;
+GRANT SELECT, INSERT, UPDATE ON item_daily_sketches TO mcp_write;
+GRANT SELECT, INSERT, UPDATE ON report_snapshots TO mcp_write;
+GRANT INSERT ON chat_logs TO mcp_write;
 ALTER DEFAULT PRIVILEGES IN SCHEMA public GRANT SELECT ON TABLES TO mcp_write;
 
 -- Seed data (Jan 1, 2026 - Feb 28, 2026)
@@ -0,0 +1,173 @@
+"""Concurrency sweep driver for ``POST /generate-report``.
+
+For each concurrency level it seeds fresh ``PROCESSING`` rows in
+``report_generation_staging``, fires one request per row with that many
+requests in flight, and prints throughput, p50/p95/p99 latency, error rate and
+the per-stage breakdown reported by the agent in ``timings_ms``. Seeded rows
+and the ``report_snapshots`` written for them are deleted afterwards unless
+``--keep`` is given, so the DSN needs a role with DELETE on both tables (e.g.
+the database owner; ``mcp_write`` has none).
+
+    LOADTEST_DSN="host=localhost port=54321 dbname=paylabs_db user=paylabs password=paylabs" \\
+    python loadtest/driver.py --agent-url http://localhost:8000 --concurrency 1,4,8,16 --requests 64
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import statistics
+import time
+import uuid
+from collections import defaultdict
+
+import httpx
+import psycopg
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    # nearest-rank
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def seed_reports(dsn: str, run_id: str, count: int, merchant_id: str) -> list[str]:
+    report_ids = [f"loadtest-{run_id}-{i:05d}" for i in range(count)]
+    with psycopg.connect(dsn) as conn:
+        with conn.cursor() as cur:
+            cur.executemany(
+                """
+                INSERT INTO report_generation_staging (report_id, merchant_id, status)
+                VALUES (%s, %s, 'PROCESSING')
+                ON CONFLICT (report_id) DO NOTHING
+                """,
+                [(report_id, merchant_id) for report_id in report_ids],
+            )
+    return report_ids
+
+
+def cleanup_reports(dsn: str, run_id: str) -> None:
+    pattern = f"loadtest-{run_id}-%"
+    with psycopg.connect(dsn) as conn:
+        with conn.cursor() as cur:
+            # READY runs also leave a snapshot for follow-up chat.
+            cur.execute("DELETE FROM report_snapshots WHERE report_id LIKE %s", (pattern,))
+            cur.execute("DELETE FROM report_generation_staging WHERE report_id LIKE %s", (pattern,))
+
+
+async def run_level(
+    client: httpx.AsyncClient,
+    agent_url: str,
+    report_ids: list[str],
+    concurrency: int,
+    args: argparse.Namespace,
+) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    stages: dict[str, list[float]] = defaultdict(list)
+    errors: dict[str, int] = defaultdict(int)
+
+    async def one(report_id: str) -> None:
+        body = {
+            "report_id": report_id,
+            "merchant_id": args.merchant_id,
+            "start_date": args.start_date,
+            "end_date": args.end_date,
+        }
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.post(f"{agent_url}/generate-report", json=body)
+            except httpx.HTTPError as exc:
+                errors[type(exc).__name__] += 1
+                return
+            latencies.append(time.perf_counter() - started)
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = {}
+        if response.status_code != 200:
+            errors[f"HTTP {response.status_code}"] += 1
+            payload = payload.get("detail", {}) if isinstance(payload, dict) else {}
+        for stage, ms in (payload.get("timings_ms") or {}).items():
+            stages[stage].append(ms)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(report_id) for report_id in report_ids))
+    wall = time.perf_counter() - started
+    total = len(report_ids)
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "wall_s": round(wall, 2),
+        "throughput_rps": round(total / wall, 2) if wall else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "error_rate": round(sum(errors.values()) / total, 4) if total else 0.0,
+        "errors": dict(errors),
+        "stages_ms": {
+            stage: {
+                "p50": round(percentile(values, 50), 1),
+                "p95": round(percentile(values, 95), 1),
+                "mean": round(statistics.fmean(values), 1),
+            }
+            for stage, values in sorted(stages.items())
+        },
+    }
+
+
+def print_level(result: dict) -> None:
+    print(
+        f"c={result['concurrency']:>3}  n={result['requests']:>4}  "
+        f"rps={result['throughput_rps']:>7.2f}  p50={result['p50_ms']:>8.1f}ms  "
+        f"p95={result['p95_ms']:>8.1f}ms  p99={result['p99_ms']:>8.1f}ms  "
+        f"err={result['error_rate']:.2%} {result['errors'] or ''}"
+    )
+    for stage, stats in result["stages_ms"].items():
+        print(f"        {stage:<12} p50={stats['p50']:>8.1f}ms  p95={stats['p95']:>8.1f}ms  mean={stats['mean']:>8.1f}ms")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--agent-url", default="http://localhost:8000")
+    parser.add_argument("--dsn", default=os.getenv("LOADTEST_DSN", ""))
+    parser.add_argument("--concurrency", default="1,4,8,16")
+    parser.add_argument("--requests", type=int, default=64, help="requests per concurrency level")
+    parser.add_argument("--merchant-id", default="01")
+    parser.add_argument("--start-date", default="2026-01-01")
+    parser.add_argument("--end-date", default="2026-01-31")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--json", dest="json_path", help="also write results as JSON to this path")
+    parser.add_argument("--keep", action="store_true", help="keep seeded staging rows")
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error("--dsn or LOADTEST_DSN is required to seed staging rows")
+
+    run_id = uuid.uuid4().hex[:8]
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    results = []
+    try:
+        async with httpx.AsyncClient(timeout=args.timeout, limits=httpx.Limits(max_connections=max(levels))) as client:
+            health = (await client.get(f"{args.agent_url}/health")).json()
+            print(f"run={run_id} agent tools_loaded={health.get('tools_loaded')}")
+            for level in levels:
+                report_ids = seed_reports(args.dsn, f"{run_id}-c{level}", args.requests, args.merchant_id)
+                result = await run_level(client, args.agent_url, report_ids, level, args)
+                print_level(result)
+                results.append(result)
+    finally:
+        if not args.keep:
+            cleanup_reports(args.dsn, run_id)
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as handle:
+            json.dump({"run_id": run_id, "levels": results}, handle, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
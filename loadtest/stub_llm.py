@@ -0,0 +1,145 @@
+"""Deterministic OpenAI-compatible stub for offline load tests.
+
+Serves ``POST /v1/chat/completions`` (and ``GET /v1/models``) with canned
+JSON narratives after a latency drawn from a configurable, seeded
+distribution, so the agent's ``ChatOpenAI`` client can be pointed at it via
+``AGENT_BASE_URL=http://<host>:<port>/v1``. Standard library only.
+
+    python loadtest/stub_llm.py --port 8089 --latency lognormal:0.0:0.5 --error-rate 0.02
+"""
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+NARRATIVES = {
+    "financial_summary": (
+        "Net revenue for the period came from a steady base of successful transactions, "
+        "with the top-selling item driving a clear share of unit volume. Compared with the "
+        "previous period the business kept its momentum, and daily revenue stayed within a "
+        "predictable band outside of a few promotional spikes."
+    ),
+    "pattern_analysis": (
+        "Transactions cluster in the early evening, and QRIS remains the dominant payment "
+        "channel. Grocery staples lead category volume while seasonal items contribute short, "
+        "sharp peaks that should not be read as sustained demand."
+    ),
+    "strategic_advice": (
+        "Keep replenishment of the top staples ahead of the evening peak, staff checkout for "
+        "the busiest hours, and trial small incentives on secondary payment channels to reduce "
+        "concentration risk. Re-check the same metrics next period to measure the effect."
+    ),
+}
+
+
+class LatencyModel:
+    def __init__(self, spec: str, seed: int) -> None:
+        # fixed:<s> | uniform:<low>:<high> | lognormal:<mu>:<sigma> (seconds)
+        kind, *params = spec.split(":")
+        self.kind = kind
+        self.params = [float(p) for p in params]
+        if kind not in {"fixed", "uniform", "lognormal"}:
+            raise ValueError(f"unknown latency distribution: {spec}")
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        with self._lock:
+            if self.kind == "fixed":
+                return self.params[0]
+            if self.kind == "uniform":
+                return self._rng.uniform(self.params[0], self.params[1])
+            return math.exp(self._rng.gauss(self.params[0], self.params[1]))
+
+    def chance(self, rate: float) -> bool:
+        with self._lock:
+            return self._rng.random() < rate
+
+
+def make_handler(latency: LatencyModel, error_rate: float, fenced: bool):
+    content = json.dumps(NARRATIVES)
+    if fenced:
+        content = f"```json\n{content}\n```"
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status: int, body: dict) -> None:
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format: str, *args) -> None:
+            pass
+
+        def do_GET(self) -> None:
+            if self.path.rstrip("/").endswith("/models"):
+                self._send(200, {"object": "list", "data": [{"id": "stub-model", "object": "model"}]})
+                return
+            self._send(404, {"error": {"message": "not found"}})
+
+        def do_POST(self) -> None:
+            length = int(self.headers.get("Content-Length", "0"))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send(404, {"error": {"message": "not found"}})
+                return
+            time.sleep(latency.sample())
+            if latency.chance(error_rate):
+                self._send(503, {"error": {"message": "stub overloaded", "type": "server_error"}})
+                return
+            prompt_chars = sum(len(str(m.get("content", ""))) for m in request.get("messages", []))
+            prompt_tokens = prompt_chars // 4
+            completion_tokens = len(content) // 4
+            self._send(
+                200,
+                {
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "stub-model"),
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens,
+                    },
+                },
+            )
+
+    return StubHandler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", default="lognormal:0.0:0.4", help="fixed:S | uniform:LO:HI | lognormal:MU:SIGMA")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--fenced", action="store_true", help="wrap the JSON reply in a ```json fence")
+    args = parser.parse_args()
+
+    handler = make_handler(LatencyModel(args.latency, args.seed), args.error_rate, args.fenced)
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    print(f"stub LLM listening on http://{args.host}:{args.port}/v1 latency={args.latency} error_rate={args.error_rate}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
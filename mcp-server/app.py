@@ -1,12 +1,26 @@
-﻿import os
+﻿import functools
+import inspect
+import io
+import os
 import re
+import threading
+import time
+import uuid
 from contextlib import contextmanager
 from datetime import date, datetime, timedelta
 from decimal import Decimal
-from typing import Any
+from typing import Any, Callable, Iterator
 
 import psycopg
+from anyio import to_thread
 from mcp.server.fastmcp import FastMCP
+from psycopg import sql
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+
+from shared.codec import dumps, dumps_text
+from ingest import parse_ingest_batch
+from sketches import merge_sketches, sketch_from_totals, sketch_top, space_saving_update
 
 
 mcp = FastMCP(
@@ -25,9 +39,63 @@ def _get_db_dsn(user_env: str, password_env: str) -> str:
     return f"host={host} port={port} dbname={name} user={user} password={password}"
 
 
+# Queries tagged with a caller's cancel_key run under this application_name
+# so cancel_queries can find their backends.
+_CANCEL_APP_PREFIX = "paylabs-mcp:"
+_CANCEL_KEY = re.compile(r"[A-Za-z0-9_-]{1,40}")
+
+
+def _session_options(cancel_key: str | None) -> dict[str, str]:
+    options: dict[str, str] = {}
+    if cancel_key is not None:
+        if not _CANCEL_KEY.fullmatch(cancel_key):
+            raise ValueError("cancel_key must be 1-40 characters of [A-Za-z0-9_-]")
+        options["application_name"] = f"{_CANCEL_APP_PREFIX}{cancel_key}"
+    return options
+
+
+# Set by the _tool wrapper for the duration of a call: when the MCP request
+# arrived (time.monotonic, this host's clock).
+_call_context = threading.local()
+
+
+def _statement_deadline(timeout_ms: int | None) -> float | None:
+    # time.monotonic by which every statement of a tool call must finish.
+    # timeout_ms is the caller's remaining budget, anchored at arrival so time
+    # spent waiting for a worker thread counts against it; no cross-host
+    # clock comparison is involved.
+    if timeout_ms is None:
+        return None
+    if timeout_ms < 1:
+        raise ValueError("timeout_ms must be >= 1")
+    arrived = getattr(_call_context, "arrived", None) or time.monotonic()
+    return arrived + timeout_ms / 1000
+
+
+class _DeadlineCursor(psycopg.Cursor):
+    # Re-arms statement_timeout before each statement with the time left until
+    # the deadline, so a tool running several statements never gets more than
+    # its budget in total.
+    def __init__(self, *args: Any, deadline: float | None = None, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.deadline = deadline
+
+    def execute(self, query: Any, params: Any = None, **kwargs: Any) -> "_DeadlineCursor":
+        if self.deadline is not None:
+            remaining_ms = int((self.deadline - time.monotonic()) * 1000)
+            if remaining_ms < 1:
+                raise psycopg.errors.QueryCanceled("deadline passed before the statement started")
+            super().execute("SELECT set_config('statement_timeout', %s, true)", (str(remaining_ms),))
+        return super().execute(query, params, **kwargs)
+
+
 @contextmanager
-def _db_read_conn():
-    conn = psycopg.connect(_get_db_dsn("DB_READ_USER", "DB_READ_PASSWORD"))
+def _db_read_conn(deadline: float | None = None, cancel_key: str | None = None):
+    conn = psycopg.connect(
+        _get_db_dsn("DB_READ_USER", "DB_READ_PASSWORD"),
+        cursor_factory=functools.partial(_DeadlineCursor, deadline=deadline),
+        **_session_options(cancel_key),
+    )
     try:
         yield conn
     finally:
@@ -59,14 +127,6 @@ def _safe_pct_change(current: float, previous: float) -> float | None:
     return round(((current - previous) / previous) * 100.0, 2)
 
 
-def _json_safe(value: Any) -> Any:
-    if isinstance(value, Decimal):
-        return float(value)
-    if isinstance(value, (datetime, date)):
-        return value.isoformat()
-    return value
-
-
 def _ok(data: dict[str, Any]) -> dict[str, Any]:
     return {"ok": True, "data": data, "error": None}
 
@@ -83,14 +143,66 @@ def _err(error_code: str, error_message: str, details: dict[str, Any] | None = N
     }
 
 
+def _tool(fn: Callable[..., dict[str, Any]]) -> Callable[..., dict[str, Any]]:
+    # Register an MCP wrapper that encodes the result once with the shared codec
+    # (Decimal/date handled natively) instead of letting the framework re-encode
+    # the dict as indented JSON plus structured content. The module-level name
+    # stays the plain dict-returning function for direct calls.
+    # Tools run in a worker thread so a slow query never blocks the event
+    # loop, which must stay free to serve cancel_queries for that query.
+    @functools.wraps(fn)
+    async def encoded(*args: Any, **kwargs: Any) -> str:
+        arrived = time.monotonic()
+
+        def call() -> dict[str, Any]:
+            _call_context.arrived = arrived
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _call_context.arrived = None
+
+        result = await to_thread.run_sync(call)
+        return dumps_text(result)
+
+    encoded.__signature__ = inspect.signature(fn).replace(return_annotation=str)
+    try:
+        register = mcp.tool(structured_output=False)
+    except TypeError:
+        register = mcp.tool()
+    register(encoded)
+    return fn
+
+
 def _handle_error(exc: Exception, details: dict[str, Any] | None = None) -> dict[str, Any]:
     if isinstance(exc, ValueError):
         return _err("VALIDATION_ERROR", str(exc), details)
+    if isinstance(exc, psycopg.errors.QueryCanceled):
+        # statement_timeout expired or cancel_queries was called.
+        return _err("QUERY_CANCELLED", str(exc).strip(), details)
     if isinstance(exc, psycopg.Error):
         return _err("DATABASE_ERROR", str(exc).strip(), details)
     return _err("INTERNAL_ERROR", str(exc), details)
 
 
+_INGEST_TX_TYPES = ["uuid", "text", "numeric", "numeric", "numeric", "text", "text", "timestamp"]
+_INGEST_ITEM_TYPES = ["uuid", "text", "text", "int4", "numeric"]
+
+
+_SKETCH_DIMENSIONS = {"item": "ti.item_name", "category": "ti.category"}
+# Advisory lock class for per-merchant sketch maintenance (ingest vs rebuild).
+_SKETCH_LOCK_CLASS = 7301
+
+
+def _sketch_capacity() -> int:
+    return int(os.getenv("SKETCH_CAPACITY", "64"))
+
+
+def _lock_merchant_sketches(cur: psycopg.Cursor, merchant_ids: list[str]) -> None:
+    # Sorted so concurrent ingest batches always lock in the same order.
+    for merchant_id in sorted(set(merchant_ids)):
+        cur.execute("SELECT pg_advisory_xact_lock(%s, hashtext(%s))", (_SKETCH_LOCK_CLASS, merchant_id))
+
+
 def _validate_read_query(sql: str) -> str:
     query = sql.strip().rstrip(";")
     lower_query = query.lower()
@@ -106,23 +218,26 @@ def _validate_read_query(sql: str) -> str:
     return query
 
 
-@mcp.tool()
-def run_read_query(sql: str, limit: int = 200) -> dict[str, Any]:
+@_tool
+def run_read_query(
+    sql: str,
+    limit: int = 200,
+    timeout_ms: int | None = None,
+    cancel_key: str | None = None,
+) -> dict[str, Any]:
     try:
         query = _validate_read_query(sql)
         if limit < 1 or limit > 1000:
             raise ValueError("limit must be between 1 and 1000")
 
-        wrapped_query = f"SELECT * FROM ({query}) AS q LIMIT %s"
-        with _db_read_conn() as conn:
+        with _db_read_conn(_statement_deadline(timeout_ms), cancel_key) as conn:
+            wrapped_query = f"SELECT * FROM ({query}) AS q LIMIT %s"
             with conn.cursor() as cur:
                 cur.execute(wrapped_query, (limit,))
                 rows = cur.fetchall()
                 columns = [desc.name for desc in cur.description or []]
 
-        data_rows = []
-        for row in rows:
-            data_rows.append({k: _json_safe(v) for k, v in zip(columns, row)})
+        data_rows = [dict(zip(columns, row)) for row in rows]
 
         return _ok(
             {
@@ -136,7 +251,127 @@ def run_read_query(sql: str, limit: int = 200) -> dict[str, Any]:
         return _handle_error(exc, {"tool": "run_read_query"})
 
 
-@mcp.tool()
+# Fixed queries for follow-up chat. The model picks one by name and a date
+# range; merchant_id is always a bind parameter, so no model-written SQL runs.
+_CHAT_QUERIES = {
+    "revenue_by_day": """
+        SELECT t.created_at::date AS day, COUNT(*) AS transactions, SUM(t.net_amount) AS revenue
+        FROM transactions t
+        WHERE t.merchant_id = %(merchant_id)s
+          AND t.status = 'SUCCESS'
+          AND t.created_at::date BETWEEN %(start)s AND %(end)s
+        GROUP BY 1
+        ORDER BY 1
+    """,
+    "revenue_by_hour": """
+        SELECT EXTRACT(HOUR FROM t.created_at)::int AS hour, COUNT(*) AS transactions, SUM(t.net_amount) AS revenue
+        FROM transactions t
+        WHERE t.merchant_id = %(merchant_id)s
+          AND t.status = 'SUCCESS'
+          AND t.created_at::date BETWEEN %(start)s AND %(end)s
+        GROUP BY 1
+        ORDER BY 1
+    """,
+    "revenue_by_payment_method": """
+        SELECT t.payment_method, COUNT(*) AS transactions, SUM(t.net_amount) AS revenue
+        FROM transactions t
+        WHERE t.merchant_id = %(merchant_id)s
+          AND t.status = 'SUCCESS'
+          AND t.created_at::date BETWEEN %(start)s AND %(end)s
+        GROUP BY 1
+        ORDER BY revenue DESC
+    """,
+    "transactions_by_status": """
+        SELECT t.status, COUNT(*) AS transactions, SUM(t.gross_amount) AS gross_amount
+        FROM transactions t
+        WHERE t.merchant_id = %(merchant_id)s
+          AND t.created_at::date BETWEEN %(start)s AND %(end)s
+        GROUP BY 1
+        ORDER BY transactions DESC
+    """,
+    "fees": """
+        SELECT
+            SUM(t.gross_amount) AS gross_amount,
+            SUM(t.fee_deducted) AS fees,
+            SUM(t.net_amount) AS net_amount,
+            ROUND(SUM(t.fee_deducted) / NULLIF(SUM(t.gross_amount), 0) * 100, 3) AS fee_pct
+        FROM transactions t
+        WHERE t.merchant_id = %(merchant_id)s
+          AND t.status = 'SUCCESS'
+          AND t.created_at::date BETWEEN %(start)s AND %(end)s
+    """,
+    "items_by_quantity": """
+        SELECT ti.item_name, ti.category, SUM(ti.quantity) AS quantity, SUM(ti.quantity * ti.unit_price) AS sales
+        FROM transaction_items ti
+        JOIN transactions t ON t.transaction_id = ti.transaction_id
+        WHERE t.merchant_id = %(merchant_id)s
+          AND t.status = 'SUCCESS'
+          AND t.created_at::date BETWEEN %(start)s AND %(end)s
+        GROUP BY 1, 2
+        ORDER BY quantity DESC, ti.item_name
+    """,
+    "categories_by_quantity": """
+        SELECT ti.category, SUM(ti.quantity) AS quantity, SUM(ti.quantity * ti.unit_price) AS sales
+        FROM transaction_items ti
+        JOIN transactions t ON t.transaction_id = ti.transaction_id
+        WHERE t.merchant_id = %(merchant_id)s
+          AND t.status = 'SUCCESS'
+          AND t.created_at::date BETWEEN %(start)s AND %(end)s
+        GROUP BY 1
+        ORDER BY quantity DESC, ti.category
+    """,
+}
+
+
+@_tool
+def run_chat_query(
+    merchant_id: str,
+    query_name: str,
+    start_date: str,
+    end_date: str,
+    limit: int = 50,
+    timeout_ms: int | None = None,
+    cancel_key: str | None = None,
+) -> dict[str, Any]:
+    try:
+        if query_name not in _CHAT_QUERIES:
+            raise ValueError(f"query_name must be one of {sorted(_CHAT_QUERIES)}")
+        if not merchant_id:
+            raise ValueError("merchant_id is required")
+        start = _parse_date(start_date)
+        end = _parse_date(end_date)
+        if end < start:
+            raise ValueError("end_date must be >= start_date")
+        if (end - start).days > 400:
+            raise ValueError("date range cannot exceed 400 days")
+        if limit < 1 or limit > 1000:
+            raise ValueError("limit must be between 1 and 1000")
+
+        with _db_read_conn(_statement_deadline(timeout_ms), cancel_key) as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"SELECT * FROM ({_CHAT_QUERIES[query_name]}) AS q LIMIT %(limit)s",
+                    {"merchant_id": merchant_id, "start": start, "end": end, "limit": limit},
+                )
+                rows = cur.fetchall()
+                columns = [desc.name for desc in cur.description or []]
+
+        return _ok(
+            {
+                "query_name": query_name,
+                "start_date": start.isoformat(),
+                "end_date": end.isoformat(),
+                "row_count": len(rows),
+                "limit": limit,
+                "columns": columns,
+                "rows": [dict(zip(columns, row)) for row in rows],
+            }
+        )
+    except Exception as exc:
+        return _handle_error(exc, {"tool": "run_chat_query", "merchant_id": merchant_id, "query_name": query_name})
+
+
+@_tool
 def get_report_context(report_id: str) -> dict[str, Any]:
     try:
         with _db_read_conn() as conn:
@@ -167,8 +402,88 @@ def get_report_context(report_id: str) -> dict[str, Any]:
         return _handle_error(exc, {"tool": "get_report_context", "report_id": report_id})
 
 
-@mcp.tool()
-def get_report_metrics(merchant_id: str, start_date: str, end_date: str) -> dict[str, Any]:
+def _exact_top(
+    cur: psycopg.Cursor,
+    dimension: str,
+    merchant_id: str,
+    start: date,
+    end: date,
+    candidates: list[str] | None = None,
+) -> tuple[str | None, int]:
+    column = sql.SQL(_SKETCH_DIMENSIONS[dimension])
+    candidate_filter = sql.SQL("")
+    params: list[Any] = [merchant_id, start, end]
+    if candidates is not None:
+        candidate_filter = sql.SQL("AND {} = ANY(%s)").format(column)
+        params.append(candidates)
+    cur.execute(
+        sql.SQL(
+            """
+            SELECT
+                {column},
+                SUM(ti.quantity) AS total_qty
+            FROM transaction_items ti
+            JOIN transactions t ON t.transaction_id = ti.transaction_id
+            WHERE t.merchant_id = %s
+              AND t.status = 'SUCCESS'
+              AND t.created_at::date BETWEEN %s AND %s
+              AND {column} IS NOT NULL
+              {candidate_filter}
+            GROUP BY {column}
+            ORDER BY total_qty DESC, {column} ASC
+            LIMIT 1
+            """
+        ).format(column=column, candidate_filter=candidate_filter),
+        params,
+    )
+    row = cur.fetchone()
+    return (row[0], int(row[1])) if row else (None, 0)
+
+
+def _heavy_hitter(
+    cur: psycopg.Cursor,
+    dimension: str,
+    merchant_id: str,
+    start: date,
+    end: date,
+) -> dict[str, Any]:
+    # Answer from merged daily sketches; verify exactly (restricted to the
+    # candidate keys when possible) if coverage or error bounds are ambiguous.
+    cur.execute(
+        """
+        SELECT capacity, counters
+        FROM item_daily_sketches
+        WHERE merchant_id = %s AND dimension = %s AND day BETWEEN %s AND %s
+        """,
+        (merchant_id, dimension, start, end),
+    )
+    rows = cur.fetchall()
+    days = (end - start).days + 1
+    if len(rows) < days:
+        name, qty = _exact_top(cur, dimension, merchant_id, start, end)
+        return {"name": name, "qty": qty, "source": "exact", "reason": "incomplete_sketch_coverage"}
+
+    merged, unseen_bound = merge_sketches([(counters, capacity) for capacity, counters in rows])
+    top = sketch_top(merged, unseen_bound)
+    if top["exact"]:
+        return {"name": top["name"], "qty": top["qty"], "source": "sketch", "reason": None}
+    if top["candidates"] is None:
+        name, qty = _exact_top(cur, dimension, merchant_id, start, end)
+        return {"name": name, "qty": qty, "source": "exact", "reason": "unseen_key_bound"}
+    name, qty = _exact_top(cur, dimension, merchant_id, start, end, top["candidates"])
+    reason = "count_error" if top["decided"] else "ambiguous_candidates"
+    return {"name": name, "qty": qty, "source": "sketch_verified", "reason": reason, "candidates": len(top["candidates"])}
+
+
+@_tool
+def get_report_metrics(
+    merchant_id: str,
+    start_date: str,
+    end_date: str,
+    use_sketches: bool = False,
+    timeout_ms: int | None = None,
+    cancel_key: str | None = None,
+) -> dict[str, Any]:
     try:
         start = _parse_date(start_date)
         end = _parse_date(end_date)
@@ -179,7 +494,7 @@ def get_report_metrics(merchant_id: str, start_date: str, end_date: str) -> dict
         prev_start = start - timedelta(days=days)
         prev_end = start - timedelta(days=1)
 
-        with _db_read_conn() as conn:
+        with _db_read_conn(_statement_deadline(timeout_ms), cancel_key) as conn:
             with conn.cursor() as cur:
                 cur.execute(
                     """
@@ -195,23 +510,19 @@ def get_report_metrics(merchant_id: str, start_date: str, end_date: str) -> dict
                 )
                 total_revenue, transaction_count = cur.fetchone()
 
-                cur.execute(
-                    """
-                    SELECT
-                        ti.item_name,
-                        SUM(ti.quantity) AS total_qty
-                    FROM transaction_items ti
-                    JOIN transactions t ON t.transaction_id = ti.transaction_id
-                    WHERE t.merchant_id = %s
-                      AND t.status = 'SUCCESS'
-                      AND t.created_at::date BETWEEN %s AND %s
-                    GROUP BY ti.item_name
-                    ORDER BY total_qty DESC, ti.item_name ASC
-                    LIMIT 1
-                    """,
-                    (merchant_id, start, end),
-                )
-                top_item = cur.fetchone()
+                heavy_hitters = None
+                if use_sketches:
+                    heavy_hitters = {
+                        dimension: _heavy_hitter(cur, dimension, merchant_id, start, end)
+                        for dimension in _SKETCH_DIMENSIONS
+                    }
+                    top_item = heavy_hitters["item"]["name"], heavy_hitters["item"]["qty"]
+                    if top_item[0] is None:
+                        top_item = None
+                else:
+                    top_item = _exact_top(cur, "item", merchant_id, start, end)
+                    if top_item[0] is None:
+                        top_item = None
 
                 cur.execute(
                     """
@@ -267,26 +578,32 @@ def get_report_metrics(merchant_id: str, start_date: str, end_date: str) -> dict
         total_revenue_f = _to_float(total_revenue)
         prev_revenue_f = _to_float(prev_revenue)
 
-        return _ok(
-            {
-                "merchant_id": merchant_id,
-                "start_date": start_date,
-                "end_date": end_date,
-                "total_revenue": round(total_revenue_f, 2),
-                "transaction_count": int(transaction_count or 0),
-                "top_selling_item_name": top_selling_item_name,
-                "top_selling_item_qty": top_selling_item_qty,
-                "peak_sales_hour": peak_window,
-                "payment_method_breakdown": [
-                    {"payment_method": row[0], "transaction_count": int(row[1])}
-                    for row in payment_rows
-                ],
-                "previous_period_start": prev_start.isoformat(),
-                "previous_period_end": prev_end.isoformat(),
-                "previous_period_revenue": round(prev_revenue_f, 2),
-                "revenue_change_pct": _safe_pct_change(total_revenue_f, prev_revenue_f),
+        data = {
+            "merchant_id": merchant_id,
+            "start_date": start_date,
+            "end_date": end_date,
+            "total_revenue": round(total_revenue_f, 2),
+            "transaction_count": int(transaction_count or 0),
+            "top_selling_item_name": top_selling_item_name,
+            "top_selling_item_qty": top_selling_item_qty,
+            "peak_sales_hour": peak_window,
+            "payment_method_breakdown": [
+                {"payment_method": row[0], "transaction_count": int(row[1])}
+                for row in payment_rows
+            ],
+            "previous_period_start": prev_start.isoformat(),
+            "previous_period_end": prev_end.isoformat(),
+            "previous_period_revenue": round(prev_revenue_f, 2),
+            "revenue_change_pct": _safe_pct_change(total_revenue_f, prev_revenue_f),
+        }
+        if heavy_hitters:
+            data["top_selling_category_name"] = heavy_hitters["category"]["name"]
+            data["top_selling_category_qty"] = heavy_hitters["category"]["qty"]
+            data["heavy_hitters"] = {
+                dimension: {k: v for k, v in answer.items() if k not in {"name", "qty"}}
+                for dimension, answer in heavy_hitters.items()
             }
-        )
+        return _ok(data)
     except Exception as exc:
         return _handle_error(
             exc,
@@ -299,7 +616,95 @@ def get_report_metrics(merchant_id: str, start_date: str, end_date: str) -> dict
         )
 
 
-@mcp.tool()
+@_tool
+def claim_report_run(
+    report_id: str,
+    claim_token: str,
+    lease_seconds: int = 600,
+    idempotency_window_seconds: int = 300,
+    start_date: str | None = None,
+    end_date: str | None = None,
+) -> dict[str, Any]:
+    try:
+        if not claim_token.strip():
+            raise ValueError("claim_token cannot be empty")
+        if lease_seconds < 1:
+            raise ValueError("lease_seconds must be >= 1")
+        if idempotency_window_seconds < 0:
+            raise ValueError("idempotency_window_seconds must be >= 0")
+        period_start = _parse_date(start_date) if start_date else None
+        period_end = _parse_date(end_date) if end_date else None
+
+        # Conditional status transition: only one agent run can hold the row.
+        # READY rows are reclaimable only once they fall out of the idempotency
+        # window; live claims of other runs are respected until the lease expires.
+        with _db_write_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE report_generation_staging
+                    SET
+                        status = 'PROCESSING',
+                        claim_token = %s,
+                        claimed_at = CURRENT_TIMESTAMP,
+                        period_start = %s,
+                        period_end = %s
+                    WHERE report_id = %s
+                      AND (
+                          claim_token IS NULL
+                          OR claim_token = %s
+                          OR claimed_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                      )
+                      AND (
+                          status <> 'READY'
+                          OR generation_date < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                      )
+                    RETURNING report_id
+                    """,
+                    (
+                        claim_token,
+                        period_start,
+                        period_end,
+                        report_id,
+                        claim_token,
+                        lease_seconds,
+                        idempotency_window_seconds,
+                    ),
+                )
+                claimed = cur.fetchone() is not None
+                cur.execute(
+                    """
+                    SELECT status, generation_date, claim_token IS NOT NULL AS in_progress, period_start, period_end
+                    FROM report_generation_staging
+                    WHERE report_id = %s
+                    """,
+                    (report_id,),
+                )
+                row = cur.fetchone()
+            conn.commit()
+
+        if not row:
+            return _ok({"claimed": False, "found": False, "report_id": report_id})
+
+        return _ok(
+            {
+                "claimed": claimed,
+                "found": True,
+                "report_id": report_id,
+                "status": row[0],
+                "generation_date": row[1].isoformat() if row[1] else None,
+                "in_progress": bool(row[2]),
+                # Period the stored row was generated for, so callers can tell
+                # a replay of the same request from a different one.
+                "start_date": row[3].isoformat() if row[3] else None,
+                "end_date": row[4].isoformat() if row[4] else None,
+            }
+        )
+    except Exception as exc:
+        return _handle_error(exc, {"tool": "claim_report_run", "report_id": report_id})
+
+
+@_tool
 def update_report_staging(
     report_id: str,
     status: str,
@@ -310,13 +715,20 @@ def update_report_staging(
     financial_summary: str | None = None,
     pattern_analysis: str | None = None,
     strategic_advice: str | None = None,
+    claim_token: str | None = None,
+    snapshot: dict[str, Any] | None = None,
 ) -> dict[str, Any]:
     try:
-        allowed = {"PROCESSING", "READY", "FAILED"}
+        allowed = {"PROCESSING", "READY", "FAILED", "CANCELLED"}
         status_upper = status.upper()
         if status_upper not in allowed:
             raise ValueError(f"status must be one of {sorted(allowed)}")
+        snapshot_row = _parse_snapshot(snapshot) if snapshot is not None else None
 
+        # When a claim_token is given, the write only lands if this run still
+        # owns the row; terminal statuses release the claim. Without a token a
+        # FAILED/CANCELLED write only touches unclaimed rows that are not READY,
+        # so a caller that never claimed cannot kill another run or a report.
         with _db_write_conn() as conn:
             with conn.cursor() as cur:
                 cur.execute(
@@ -331,8 +743,16 @@ def update_report_staging(
                         financial_summary = COALESCE(%s, financial_summary),
                         pattern_analysis = COALESCE(%s, pattern_analysis),
                         strategic_advice = COALESCE(%s, strategic_advice),
+                        claim_token = CASE WHEN %s = 'PROCESSING' THEN claim_token ELSE NULL END,
+                        claimed_at = CASE WHEN %s = 'PROCESSING' THEN claimed_at ELSE NULL END,
                         generation_date = CURRENT_TIMESTAMP
                     WHERE report_id = %s
+                      AND (%s::text IS NULL OR claim_token = %s)
+                      AND (
+                          %s::text IS NOT NULL
+                          OR %s NOT IN ('FAILED', 'CANCELLED')
+                          OR (claim_token IS NULL AND status <> 'READY')
+                      )
                     RETURNING report_id, status, generation_date
                     """,
                     (
@@ -344,10 +764,37 @@ def update_report_staging(
                         financial_summary,
                         pattern_analysis,
                         strategic_advice,
+                        status_upper,
+                        status_upper,
                         report_id,
+                        claim_token,
+                        claim_token,
+                        claim_token,
+                        status_upper,
                     ),
                 )
                 row = cur.fetchone()
+                # Saved in the same transaction as the READY write, so a
+                # chat never sees a report without its snapshot.
+                if row and snapshot_row:
+                    cur.execute(
+                        """
+                        INSERT INTO report_snapshots (
+                            report_id, merchant_id, start_date, end_date, skill, metrics, evidence, narratives
+                        )
+                        VALUES (%s, %s, %s, %s, %s, %s::jsonb, %s::jsonb, %s::jsonb)
+                        ON CONFLICT (report_id) DO UPDATE
+                        SET merchant_id = EXCLUDED.merchant_id,
+                            start_date = EXCLUDED.start_date,
+                            end_date = EXCLUDED.end_date,
+                            skill = EXCLUDED.skill,
+                            metrics = EXCLUDED.metrics,
+                            evidence = EXCLUDED.evidence,
+                            narratives = EXCLUDED.narratives,
+                            created_at = CURRENT_TIMESTAMP
+                        """,
+                        (report_id, *snapshot_row),
+                    )
             conn.commit()
 
         if not row:
@@ -359,25 +806,81 @@ def update_report_staging(
                 "report_id": str(row[0]),
                 "status": row[1],
                 "generation_date": row[2].isoformat() if row[2] else None,
+                "snapshot_saved": snapshot_row is not None,
             }
         )
     except Exception as exc:
         return _handle_error(exc, {"tool": "update_report_staging", "report_id": report_id})
 
 
-@mcp.tool()
-def mark_report_failed(report_id: str, reason: str) -> dict[str, Any]:
+def _parse_snapshot(snapshot: dict[str, Any]) -> tuple:
+    merchant_id = str(snapshot.get("merchant_id") or "").strip()
+    if not merchant_id:
+        raise ValueError("snapshot.merchant_id is required")
+    start = _parse_date(str(snapshot.get("start_date", "")))
+    end = _parse_date(str(snapshot.get("end_date", "")))
+    blobs = []
+    for key in ("metrics", "evidence", "narratives"):
+        value = snapshot.get(key, {})
+        if not isinstance(value, dict):
+            raise ValueError(f"snapshot.{key} must be an object")
+        blobs.append(dumps_text(value))
+    skill = snapshot.get("skill")
+    return (merchant_id, start, end, str(skill) if skill else None, *blobs)
+
+
+@_tool
+def mark_report_failed(report_id: str, reason: str, claim_token: str | None = None) -> dict[str, Any]:
     try:
         return update_report_staging(
             report_id=report_id,
             status="FAILED",
             financial_summary=f"Report generation failed: {reason}",
+            claim_token=claim_token,
         )
     except Exception as exc:
         return _handle_error(exc, {"tool": "mark_report_failed", "report_id": report_id})
 
 
-@mcp.tool()
+@_tool
+def mark_report_cancelled(report_id: str, reason: str, claim_token: str | None = None) -> dict[str, Any]:
+    try:
+        return update_report_staging(
+            report_id=report_id,
+            status="CANCELLED",
+            financial_summary=f"Report generation cancelled: {reason}",
+            claim_token=claim_token,
+        )
+    except Exception as exc:
+        return _handle_error(exc, {"tool": "mark_report_cancelled", "report_id": report_id})
+
+
+@_tool
+def cancel_queries(cancel_key: str) -> dict[str, Any]:
+    try:
+        application_name = _session_options(cancel_key)["application_name"]
+        # pg_cancel_backend on the read role's own backends needs no extra
+        # privilege; the running statement fails with QueryCanceled.
+        with _db_read_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT COUNT(*) FILTER (WHERE pg_cancel_backend(pid))
+                    FROM pg_stat_activity
+                    WHERE application_name = %s
+                      AND state = 'active'
+                      AND pid <> pg_backend_pid()
+                    """,
+                    (application_name,),
+                )
+                cancelled = cur.fetchone()[0]
+
+        return _ok({"cancel_key": cancel_key, "cancelled": int(cancelled)})
+    except Exception as exc:
+        return _handle_error(exc, {"tool": "cancel_queries"})
+
+
+@_tool
 def is_report_finished() -> dict[str, Any]:
     try:
         report_id = os.getenv("ACTIVE_REPORT_ID", "")
@@ -416,7 +919,7 @@ def is_report_finished() -> dict[str, Any]:
                 "found": True,
                 "report_id": report_id,
                 "status": status,
-                "finished": status in {"READY", "FAILED"},
+                "finished": status in {"READY", "FAILED", "CANCELLED"},
                 "generation_date": row[1].isoformat() if row[1] else None,
             }
         )
@@ -424,5 +927,710 @@ def is_report_finished() -> dict[str, Any]:
         return _handle_error(exc, {"tool": "is_report_finished"})
 
 
+@_tool
+def get_report_snapshot(report_id: str, chat_id: str | None = None, history_limit: int = 20) -> dict[str, Any]:
+    try:
+        if history_limit < 0 or history_limit > 200:
+            raise ValueError("history_limit must be between 0 and 200")
+        chat_uuid = uuid.UUID(chat_id) if chat_id else None
+
+        with _db_read_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT merchant_id, start_date, end_date, skill, metrics, evidence, narratives, created_at
+                    FROM report_snapshots
+                    WHERE report_id = %s
+                    """,
+                    (report_id,),
+                )
+                row = cur.fetchone()
+                if not row:
+                    return _ok({"found": False, "report_id": report_id})
+
+                history: list[dict[str, Any]] = []
+                chat_conflict = False
+                if chat_uuid:
+                    # A chat_id is bound to the report (and merchant) of its
+                    # first turn; reusing it for another report is rejected.
+                    cur.execute(
+                        """
+                        SELECT EXISTS (
+                            SELECT 1
+                            FROM chat_logs
+                            WHERE chat_id = %s
+                              AND (report_id IS DISTINCT FROM %s OR merchant_id IS DISTINCT FROM %s)
+                        )
+                        """,
+                        (chat_uuid, report_id, row[0]),
+                    )
+                    chat_conflict = bool(cur.fetchone()[0])
+                if chat_uuid and history_limit and not chat_conflict:
+                    cur.execute(
+                        """
+                        SELECT role, content, created_at
+                        FROM chat_logs
+                        WHERE chat_id = %s AND report_id = %s AND merchant_id = %s
+                        ORDER BY created_at DESC
+                        LIMIT %s
+                        """,
+                        (chat_uuid, report_id, row[0], history_limit),
+                    )
+                    history = [
+                        {"role": role, "content": content, "created_at": created_at.isoformat() if created_at else None}
+                        for role, content, created_at in reversed(cur.fetchall())
+                    ]
+
+        return _ok(
+            {
+                "found": True,
+                "report_id": report_id,
+                "merchant_id": row[0],
+                "start_date": row[1].isoformat(),
+                "end_date": row[2].isoformat(),
+                "skill": row[3],
+                "metrics": row[4],
+                "evidence": row[5],
+                "narratives": row[6],
+                "created_at": row[7].isoformat() if row[7] else None,
+                "history": history,
+                "chat_conflict": chat_conflict,
+            }
+        )
+    except Exception as exc:
+        return _handle_error(exc, {"tool": "get_report_snapshot", "report_id": report_id})
+
+
+_CHAT_ROLES = {"user", "assistant"}
+
+
+def _parse_chat_turns(turns: list[dict[str, Any]]) -> list[tuple]:
+    rows = []
+    for index, turn in enumerate(turns):
+        where = f"turns[{index}]"
+        if not isinstance(turn, dict):
+            raise ValueError(f"{where} must be an object")
+        role = str(turn.get("role", "")).lower()
+        if role not in _CHAT_ROLES:
+            raise ValueError(f"{where}.role must be one of {sorted(_CHAT_ROLES)}")
+        content = turn.get("content")
+        if not isinstance(content, str) or not content.strip():
+            raise ValueError(f"{where}.content must be a non-empty string")
+        merchant_id = str(turn.get("merchant_id") or "").strip()
+        if not merchant_id:
+            raise ValueError(f"{where}.merchant_id is required")
+        report_id = str(turn.get("report_id") or "").strip()
+        if not report_id:
+            raise ValueError(f"{where}.report_id is required")
+        try:
+            log_id = uuid.UUID(str(turn["log_id"])) if turn.get("log_id") else uuid.uuid4()
+            chat_id = uuid.UUID(str(turn.get("chat_id", "")))
+            created_at = datetime.fromisoformat(turn["created_at"]) if turn.get("created_at") else None
+        except ValueError as exc:
+            raise ValueError(f"{where}: {exc}") from exc
+        rows.append((log_id, chat_id, merchant_id, report_id, role, content, created_at))
+    return rows
+
+
+@_tool
+def append_chat_logs(turns: list[dict[str, Any]]) -> dict[str, Any]:
+    try:
+        max_batch = int(os.getenv("CHAT_LOG_MAX_BATCH", "1000"))
+        if not turns:
+            return _ok({"received": 0, "inserted": 0})
+        if len(turns) > max_batch:
+            raise ValueError(f"batch too large: {len(turns)} turns (max {max_batch})")
+        rows = _parse_chat_turns(turns)
+
+        # log_id makes a retried batch idempotent. The conflict target is left
+        # out on purpose: naming (log_id) would need SELECT on chat_logs, and
+        # the write role only has INSERT.
+        with _db_write_conn() as conn:
+            with conn.cursor() as cur:
+                cur.executemany(
+                    """
+                    INSERT INTO chat_logs (log_id, chat_id, merchant_id, report_id, role, content, created_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, COALESCE(%s, CURRENT_TIMESTAMP))
+                    ON CONFLICT DO NOTHING
+                    """,
+                    rows,
+                )
+                inserted = cur.rowcount
+            conn.commit()
+
+        return _ok({"received": len(rows), "inserted": inserted})
+    except Exception as exc:
+        return _handle_error(exc, {"tool": "append_chat_logs"})
+
+
+def _apply_sketch_delta(cur: psycopg.Cursor) -> int:
+    # Fold the SUCCESS items of this batch into each touched day's sketches,
+    # inside the ingest transaction. A day without sketches gets them here,
+    # so recent days stay covered without a rebuild. The merchant lock orders
+    # this against concurrent batches and rebuilds.
+    cur.execute(
+        """
+        SELECT merchant_id, day, 'item' AS dimension, item_name AS key, SUM(quantity)
+        FROM ingest_sketch_delta
+        GROUP BY merchant_id, day, item_name
+        UNION ALL
+        SELECT merchant_id, day, 'category', category, SUM(quantity)
+        FROM ingest_sketch_delta
+        WHERE category IS NOT NULL
+        GROUP BY merchant_id, day, category
+        ORDER BY 1, 2, 3, 5 DESC, 4
+        """
+    )
+    deltas: dict[tuple[str, date, str], list[tuple[str, int]]] = {}
+    for merchant_id, day, dimension, key, quantity in cur.fetchall():
+        deltas.setdefault((merchant_id, day, dimension), []).append((key, int(quantity)))
+    if not deltas:
+        return 0
+
+    _lock_merchant_sketches(cur, [merchant_id for merchant_id, _, _ in deltas])
+    created = _create_missing_sketches(cur, deltas)
+    updates = []
+    for (merchant_id, day, dimension), entries in sorted(deltas.items()):
+        if (merchant_id, day, dimension) in created:
+            continue
+        cur.execute(
+            """
+            SELECT capacity, counters, total
+            FROM item_daily_sketches
+            WHERE merchant_id = %s AND day = %s AND dimension = %s
+            FOR UPDATE
+            """,
+            (merchant_id, day, dimension),
+        )
+        sketch_capacity, counters, total = cur.fetchone()
+        for key, quantity in entries:
+            space_saving_update(counters, key, quantity, sketch_capacity)
+            total += quantity
+        updates.append((dumps_text(counters), total, merchant_id, day, dimension))
+    if updates:
+        cur.executemany(
+            """
+            UPDATE item_daily_sketches
+            SET counters = %s::jsonb, total = %s, updated_at = CURRENT_TIMESTAMP
+            WHERE merchant_id = %s AND day = %s AND dimension = %s
+            """,
+            updates,
+        )
+    return len(created) + len(updates)
+
+
+def _create_missing_sketches(
+    cur: psycopg.Cursor,
+    deltas: dict[tuple[str, date, str], list[tuple[str, int]]],
+) -> set[tuple[str, date, str]]:
+    # Must run under the merchant lock. Returns the sketches it created; they
+    # already include this batch.
+    days = sorted({(merchant_id, day) for merchant_id, day, _ in deltas})
+    cur.execute(
+        """
+        SELECT merchant_id, day, dimension
+        FROM item_daily_sketches
+        WHERE (merchant_id, day) IN (SELECT * FROM unnest(%s::text[], %s::date[]))
+        """,
+        ([merchant_id for merchant_id, _ in days], [day for _, day in days]),
+    )
+    existing = set(cur.fetchall())
+    capacity = _sketch_capacity()
+    rows = []
+    for merchant_id, day in days:
+        missing = [d for d in _SKETCH_DIMENSIONS if (merchant_id, day, d) not in existing]
+        if not missing:
+            continue
+        # If the batch holds every SUCCESS item of the day (committed earlier
+        # batches would add to the stored total), the sketch is built from
+        # the delta; otherwise the day is rebuilt from the tables.
+        batch_qty = sum(qty for _, qty in deltas.get((merchant_id, day, "item"), []))
+        from_delta = _day_key_totals(cur, None, merchant_id, day) == {None: batch_qty}
+        for dimension in missing:
+            if from_delta:
+                totals = dict(deltas.get((merchant_id, day, dimension), []))
+            else:
+                totals = _day_key_totals(cur, dimension, merchant_id, day)
+            rows.append(
+                (
+                    merchant_id,
+                    day,
+                    dimension,
+                    capacity,
+                    dumps_text(sketch_from_totals(totals, capacity)),
+                    sum(totals.values()),
+                )
+            )
+    if rows:
+        cur.executemany(
+            """
+            INSERT INTO item_daily_sketches (merchant_id, day, dimension, capacity, counters, total)
+            VALUES (%s, %s, %s, %s, %s::jsonb, %s)
+            """,
+            rows,
+        )
+    return {(merchant_id, day, dimension) for merchant_id, day, dimension, *_ in rows}
+
+
+def _day_key_totals(cur: psycopg.Cursor, dimension: str | None, merchant_id: str, day: date) -> dict[Any, int]:
+    # SUCCESS quantity per key of one merchant day; dimension None gives the
+    # day's overall quantity under the key None.
+    column = sql.SQL(_SKETCH_DIMENSIONS[dimension]) if dimension else sql.SQL("NULL::text")
+    cur.execute(
+        sql.SQL(
+            """
+            SELECT {column}, SUM(ti.quantity)
+            FROM transaction_items ti
+            JOIN transactions t ON t.transaction_id = ti.transaction_id
+            WHERE t.merchant_id = %s
+              AND t.status = 'SUCCESS'
+              AND t.created_at::date = %s
+              AND ({column} IS NOT NULL OR %s)
+            GROUP BY 1
+            """
+        ).format(column=column),
+        (merchant_id, day, dimension is None),
+    )
+    return {key: int(qty) for key, qty in cur.fetchall()}
+
+
+@_tool
+def rebuild_item_sketches(merchant_id: str, start_date: str, end_date: str) -> dict[str, Any]:
+    try:
+        start = _parse_date(start_date)
+        end = _parse_date(end_date)
+        if end < start:
+            raise ValueError("end_date must be >= start_date")
+        if (end - start).days > 400:
+            raise ValueError("date range cannot exceed 400 days")
+        capacity = _sketch_capacity()
+
+        # Exact per-day top-k has error 0 and satisfies the Space-Saving bound
+        # (every dropped key is <= the k-th count). Days without sales get an
+        # empty sketch so the range counts as covered.
+        sketches: dict[tuple[date, str], dict[str, list[int]]] = {}
+        totals: dict[tuple[date, str], int] = {}
+        with _db_write_conn() as conn:
+            with conn.cursor() as cur:
+                # Held until commit: ingest batches for this merchant wait, so
+                # their rows are either read below or folded in afterwards.
+                _lock_merchant_sketches(cur, [merchant_id])
+                for dimension, column in _SKETCH_DIMENSIONS.items():
+                    cur.execute(
+                        sql.SQL(
+                            """
+                            SELECT day, key, qty, SUM(qty) OVER (PARTITION BY day) AS day_total, rn
+                            FROM (
+                                SELECT
+                                    t.created_at::date AS day,
+                                    {column} AS key,
+                                    SUM(ti.quantity) AS qty,
+                                    ROW_NUMBER() OVER (
+                                        PARTITION BY t.created_at::date
+                                        ORDER BY SUM(ti.quantity) DESC, {column} ASC
+                                    ) AS rn
+                                FROM transaction_items ti
+                                JOIN transactions t ON t.transaction_id = ti.transaction_id
+                                WHERE t.merchant_id = %s
+                                  AND t.status = 'SUCCESS'
+                                  AND t.created_at::date BETWEEN %s AND %s
+                                  AND {column} IS NOT NULL
+                                GROUP BY t.created_at::date, {column}
+                            ) ranked
+                            """
+                        ).format(column=sql.SQL(column)),
+                        (merchant_id, start, end),
+                    )
+                    for day, key, qty, day_total, rn in cur.fetchall():
+                        totals[(day, dimension)] = int(day_total)
+                        if rn <= capacity:
+                            sketches.setdefault((day, dimension), {})[key] = [int(qty), 0]
+
+                rows = []
+                for offset in range((end - start).days + 1):
+                    day = start + timedelta(days=offset)
+                    for dimension in _SKETCH_DIMENSIONS:
+                        rows.append(
+                            (
+                                merchant_id,
+                                day,
+                                dimension,
+                                capacity,
+                                dumps_text(sketches.get((day, dimension), {})),
+                                totals.get((day, dimension), 0),
+                            )
+                        )
+                cur.executemany(
+                    """
+                    INSERT INTO item_daily_sketches (merchant_id, day, dimension, capacity, counters, total)
+                    VALUES (%s, %s, %s, %s, %s::jsonb, %s)
+                    ON CONFLICT (merchant_id, day, dimension) DO UPDATE
+                    SET capacity = EXCLUDED.capacity,
+                        counters = EXCLUDED.counters,
+                        total = EXCLUDED.total,
+                        updated_at = CURRENT_TIMESTAMP
+                    """,
+                    rows,
+                )
+            conn.commit()
+
+        return _ok(
+            {
+                "merchant_id": merchant_id,
+                "start_date": start_date,
+                "end_date": end_date,
+                "days": (end - start).days + 1,
+                "sketches_written": len(rows),
+                "capacity": capacity,
+            }
+        )
+    except Exception as exc:
+        return _handle_error(
+            exc,
+            {
+                "tool": "rebuild_item_sketches",
+                "merchant_id": merchant_id,
+                "start_date": start_date,
+                "end_date": end_date,
+            },
+        )
+
+
+@_tool
+def ingest_transactions(transactions: list[dict[str, Any]]) -> dict[str, Any]:
+    try:
+        max_batch = int(os.getenv("INGEST_MAX_BATCH", "5000"))
+        if not transactions:
+            raise ValueError("transactions cannot be empty")
+        if len(transactions) > max_batch:
+            raise ValueError(f"batch too large: {len(transactions)} > {max_batch}")
+        tx_rows, item_rows = parse_ingest_batch(transactions)
+
+        # Binary COPY into per-transaction temp tables, then one set-based merge.
+        # Transactions that already exist (by transaction_id) are skipped with
+        # their items, so replaying a batch is a no-op. Rows for unknown
+        # merchants are skipped instead of failing the whole batch.
+        with _db_write_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    CREATE TEMP TABLE ingest_transactions_stage (
+                        transaction_id UUID,
+                        merchant_id TEXT,
+                        gross_amount NUMERIC(15, 2),
+                        net_amount NUMERIC(15, 2),
+                        fee_deducted NUMERIC(15, 2),
+                        status TEXT,
+                        payment_method TEXT,
+                        created_at TIMESTAMP
+                    ) ON COMMIT DROP
+                    """
+                )
+                cur.execute(
+                    """
+                    CREATE TEMP TABLE ingest_items_stage (
+                        transaction_id UUID,
+                        item_name TEXT,
+                        category TEXT,
+                        quantity INTEGER,
+                        unit_price NUMERIC(15, 2)
+                    ) ON COMMIT DROP
+                    """
+                )
+                cur.execute(
+                    """
+                    CREATE TEMP TABLE ingest_sketch_delta (
+                        merchant_id TEXT,
+                        day DATE,
+                        item_name TEXT,
+                        category TEXT,
+                        quantity INTEGER
+                    ) ON COMMIT DROP
+                    """
+                )
+                with cur.copy(
+                    """
+                    COPY ingest_transactions_stage (
+                        transaction_id, merchant_id, gross_amount, net_amount,
+                        fee_deducted, status, payment_method, created_at
+                    ) FROM STDIN (FORMAT BINARY)
+                    """
+                ) as copy:
+                    copy.set_types(_INGEST_TX_TYPES)
+                    for row in tx_rows:
+                        copy.write_row(row)
+                if item_rows:
+                    with cur.copy(
+                        """
+                        COPY ingest_items_stage (
+                            transaction_id, item_name, category, quantity, unit_price
+                        ) FROM STDIN (FORMAT BINARY)
+                        """
+                    ) as copy:
+                        copy.set_types(_INGEST_ITEM_TYPES)
+                        for row in item_rows:
+                            copy.write_row(row)
+                cur.execute(
+                    """
+                    WITH new_transactions AS (
+                        INSERT INTO transactions (
+                            transaction_id, merchant_id, gross_amount, net_amount,
+                            fee_deducted, status, payment_method, created_at
+                        )
+                        SELECT DISTINCT ON (s.transaction_id)
+                            s.transaction_id, s.merchant_id, s.gross_amount, s.net_amount,
+                            s.fee_deducted, s.status, s.payment_method, s.created_at
+                        FROM ingest_transactions_stage s
+                        JOIN merchants m ON m.merchant_id = s.merchant_id
+                        ORDER BY s.transaction_id
+                        ON CONFLICT (transaction_id) DO NOTHING
+                        RETURNING transaction_id, merchant_id, status, created_at
+                    ),
+                    new_items AS (
+                        INSERT INTO transaction_items (
+                            transaction_id, item_name, category, quantity, unit_price
+                        )
+                        SELECT DISTINCT ON (i.transaction_id, i.item_name)
+                            i.transaction_id, i.item_name, i.category, i.quantity, i.unit_price
+                        FROM ingest_items_stage i
+                        JOIN new_transactions n ON n.transaction_id = i.transaction_id
+                        ORDER BY i.transaction_id, i.item_name
+                        ON CONFLICT (transaction_id, item_name) DO NOTHING
+                        RETURNING transaction_id, item_name, category, quantity
+                    ),
+                    sketch_delta AS (
+                        INSERT INTO ingest_sketch_delta (merchant_id, day, item_name, category, quantity)
+                        SELECT n.merchant_id, n.created_at::date, i.item_name, i.category, i.quantity
+                        FROM new_items i
+                        JOIN new_transactions n ON n.transaction_id = i.transaction_id
+                        WHERE n.status = 'SUCCESS'
+                    )
+                    SELECT
+                        (SELECT COUNT(*) FROM new_transactions),
+                        (SELECT COUNT(*) FROM new_items),
+                        (
+                            SELECT COUNT(DISTINCT s.transaction_id)
+                            FROM ingest_transactions_stage s
+                            WHERE NOT EXISTS (
+                                SELECT 1 FROM merchants m WHERE m.merchant_id = s.merchant_id
+                            )
+                        )
+                    """
+                )
+                inserted_transactions, inserted_items, unknown_merchant = cur.fetchone()
+                sketches_updated = _apply_sketch_delta(cur)
+            conn.commit()
+
+        received = len({row[0] for row in tx_rows})
+        return _ok(
+            {
+                "received_transactions": len(tx_rows),
+                "received_items": len(item_rows),
+                "inserted_transactions": int(inserted_transactions),
+                "inserted_items": int(inserted_items),
+                "skipped_unknown_merchant": int(unknown_merchant),
+                "skipped_duplicates": received - int(inserted_transactions) - int(unknown_merchant),
+                "sketches_updated": sketches_updated,
+            }
+        )
+    except Exception as exc:
+        return _handle_error(exc, {"tool": "ingest_transactions", "batch_size": len(transactions or [])})
+
+
+_EXPORT_COLUMNS = [
+    "source",
+    "report_id",
+    "merchant_id",
+    "generation_date",
+    "status",
+    "total_revenue",
+    "transaction_count",
+    "top_selling_item_name",
+    "top_selling_item_qty",
+    "financial_summary",
+    "pattern_analysis",
+    "strategic_advice",
+    "cursor",
+]
+_EXPORT_SOURCES = {
+    "staging": "report_generation_staging",
+    "history": "report_history",
+}
+_EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+def _parse_export_params(request: Request) -> dict[str, Any]:
+    params = request.query_params
+
+    def _list(name: str) -> list[str]:
+        return [v.strip() for raw in params.getlist(name) for v in raw.split(",") if v.strip()]
+
+    export_format = params.get("format", "ndjson").lower()
+    if export_format not in _EXPORT_FORMATS:
+        raise ValueError(f"format must be one of {sorted(_EXPORT_FORMATS)}")
+    sources = _list("source") or sorted(_EXPORT_SOURCES)
+    if not set(sources) <= set(_EXPORT_SOURCES):
+        raise ValueError(f"source must be within {sorted(_EXPORT_SOURCES)}")
+    statuses = [v.upper() for v in _list("status")] or ["READY"]
+    if not set(statuses) <= {"PROCESSING", "READY", "FAILED", "CANCELLED"}:
+        raise ValueError("status must be within PROCESSING, READY, FAILED, CANCELLED")
+    chunk_size = int(params.get("chunk_size", "500"))
+    if chunk_size < 1 or chunk_size > 10000:
+        raise ValueError("chunk_size must be between 1 and 10000")
+
+    after = None
+    token = params.get("cursor")
+    if token:
+        # Cursor tokens are hex("<generation_date>|<source>|<report_id>") of
+        # the last row received; see the cursor column in _export_query.
+        try:
+            generated, source, report_id = bytes.fromhex(token).decode("utf-8").split("|", 2)
+            after = (datetime.fromisoformat(generated), source, report_id)
+        except ValueError:
+            raise ValueError("invalid cursor token") from None
+
+    generated_from = params.get("generated_from")
+    generated_to = params.get("generated_to")
+    return {
+        "format": export_format,
+        "sources": sources,
+        "statuses": statuses,
+        "merchant_ids": _list("merchant_id"),
+        "generated_from": datetime.fromisoformat(generated_from) if generated_from else None,
+        "generated_to": datetime.fromisoformat(generated_to) if generated_to else None,
+        "after": after,
+        "chunk_size": chunk_size,
+    }
+
+
+def _export_query(options: dict[str, Any]) -> sql.Composed:
+    # Values are bound as literals so the same statement can run through a
+    # server-side cursor or be wrapped in COPY ... TO STDOUT.
+    selects = [
+        sql.SQL(
+            """
+            SELECT {source} AS source, report_id, merchant_id, generation_date, status,
+                   total_revenue, transaction_count, top_selling_item_name, top_selling_item_qty,
+                   financial_summary, pattern_analysis, strategic_advice
+            FROM {table}
+            """
+        ).format(source=sql.Literal(source), table=sql.Identifier(_EXPORT_SOURCES[source]))
+        for source in options["sources"]
+    ]
+    filters = [
+        sql.SQL("generation_date IS NOT NULL"),
+        sql.SQL("status = ANY({})").format(sql.Literal(options["statuses"])),
+    ]
+    if options["merchant_ids"]:
+        filters.append(sql.SQL("merchant_id = ANY({})").format(sql.Literal(options["merchant_ids"])))
+    if options["generated_from"]:
+        filters.append(sql.SQL("generation_date >= {}").format(sql.Literal(options["generated_from"])))
+    if options["generated_to"]:
+        filters.append(sql.SQL("generation_date < {}").format(sql.Literal(options["generated_to"])))
+    if options["after"]:
+        filters.append(
+            sql.SQL("(generation_date, source, report_id) > ({}::timestamp, {}, {})").format(
+                *(sql.Literal(v) for v in options["after"])
+            )
+        )
+    return sql.SQL(
+        """
+        SELECT r.*,
+               encode(convert_to(
+                   to_char(generation_date, 'YYYY-MM-DD"T"HH24:MI:SS.US') || '|' || source || '|' || report_id,
+                   'UTF8'
+               ), 'hex') AS cursor
+        FROM ({union}) AS r
+        WHERE {filters}
+        ORDER BY generation_date, source, report_id
+        """
+    ).format(union=sql.SQL(" UNION ALL ").join(selects), filters=sql.SQL(" AND ").join(filters))
+
+
+def _stream_rows(query: sql.Composed, chunk_size: int) -> Iterator[list[tuple]]:
+    # Named (server-side) cursor: only chunk_size rows are held in memory.
+    with _db_read_conn() as conn:
+        with conn.cursor(name="report_export") as cur:
+            cur.itersize = chunk_size
+            cur.execute(query)
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+
+
+def _export_ndjson(query: sql.Composed, chunk_size: int) -> Iterator[bytes]:
+    for rows in _stream_rows(query, chunk_size):
+        yield b"".join(dumps(dict(zip(_EXPORT_COLUMNS, row))) + b"\n" for row in rows)
+
+
+def _export_csv(query: sql.Composed) -> Iterator[bytes]:
+    with _db_read_conn() as conn:
+        with conn.cursor() as cur:
+            copy_sql = sql.SQL("COPY ({}) TO STDOUT WITH (FORMAT CSV, HEADER)").format(query)
+            with cur.copy(copy_sql) as copy:
+                for data in copy:
+                    yield bytes(data)
+
+
+def _export_arrow(query: sql.Composed, chunk_size: int) -> Iterator[bytes]:
+    import pyarrow as pa
+
+    schema = pa.schema(
+        [
+            ("source", pa.string()),
+            ("report_id", pa.string()),
+            ("merchant_id", pa.string()),
+            ("generation_date", pa.timestamp("us")),
+            ("status", pa.string()),
+            ("total_revenue", pa.decimal128(15, 2)),
+            ("transaction_count", pa.int32()),
+            ("top_selling_item_name", pa.string()),
+            ("top_selling_item_qty", pa.int32()),
+            ("financial_summary", pa.string()),
+            ("pattern_analysis", pa.string()),
+            ("strategic_advice", pa.string()),
+            ("cursor", pa.string()),
+        ]
+    )
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for rows in _stream_rows(query, chunk_size):
+            columns = list(zip(*rows))
+            arrays = [pa.array(values, type=field.type) for values, field in zip(columns, schema)]
+            writer.write_batch(pa.record_batch(arrays, schema=schema))
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+    yield sink.getvalue()
+
+
+@mcp.custom_route("/export/reports", methods=["GET"])
+async def export_reports(request: Request) -> Response:
+    try:
+        options = _parse_export_params(request)
+        if options["format"] == "arrow":
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise ValueError("format=arrow requires pyarrow to be installed") from None
+    except ValueError as exc:
+        return JSONResponse(_handle_error(exc, {"route": "/export/reports"}), status_code=400)
+
+    query = _export_query(options)
+    if options["format"] == "csv":
+        body = _export_csv(query)
+    elif options["format"] == "arrow":
+        body = _export_arrow(query, options["chunk_size"])
+    else:
+        body = _export_ndjson(query, options["chunk_size"])
+    return StreamingResponse(body, media_type=_EXPORT_FORMATS[options["format"]])
+
+
 if __name__ == "__main__":
     mcp.run(transport="streamable-http")
@@ -0,0 +1,87 @@
+# Validation of ingest_transactions batches into COPY-ready rows. Kept free of
+# database imports so it can be tested on its own.
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+from typing import Any
+
+
+TRANSACTION_STATUSES = {"SUCCESS", "PENDING", "FAILED", "REFUNDED"}
+
+
+def parse_amount(value: Any, field: str) -> Decimal:
+    try:
+        amount = Decimal(str(value))
+    except (InvalidOperation, TypeError):
+        raise ValueError(f"{field} must be numeric") from None
+    if not amount.is_finite():
+        raise ValueError(f"{field} must be finite")
+    return amount
+
+
+def parse_ingest_batch(transactions: list[dict[str, Any]]) -> tuple[list[tuple], list[tuple]]:
+    tx_rows: list[tuple] = []
+    item_rows: list[tuple] = []
+    for index, tx in enumerate(transactions):
+        where = f"transactions[{index}]"
+        if not isinstance(tx, dict):
+            raise ValueError(f"{where} must be an object")
+        try:
+            transaction_id = uuid.UUID(str(tx["transaction_id"]))
+            merchant_id = str(tx["merchant_id"]).strip()
+            status = str(tx.get("status", "SUCCESS")).upper()
+            payment_method = str(tx["payment_method"]).strip()
+            created_at = datetime.fromisoformat(str(tx["created_at"]))
+        except KeyError as exc:
+            raise ValueError(f"{where} is missing {exc.args[0]}") from None
+        except ValueError as exc:
+            raise ValueError(f"{where}: {exc}") from None
+        if not merchant_id or not payment_method:
+            raise ValueError(f"{where}: merchant_id and payment_method cannot be empty")
+        if status not in TRANSACTION_STATUSES:
+            raise ValueError(f"{where}: status must be one of {sorted(TRANSACTION_STATUSES)}")
+        if created_at.tzinfo is not None:
+            # transactions.created_at is a naive UTC timestamp; convert rather
+            # than drop the offset so rows land on the right day.
+            created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+        gross_amount = parse_amount(tx.get("gross_amount"), f"{where}.gross_amount")
+        fee_deducted = parse_amount(tx.get("fee_deducted", 0), f"{where}.fee_deducted")
+        net_amount = (
+            parse_amount(tx["net_amount"], f"{where}.net_amount")
+            if tx.get("net_amount") is not None
+            else gross_amount - fee_deducted
+        )
+        tx_rows.append(
+            (
+                transaction_id,
+                merchant_id,
+                gross_amount,
+                net_amount,
+                fee_deducted,
+                status,
+                payment_method,
+                created_at,
+            )
+        )
+
+        items = tx.get("items", [])
+        if not isinstance(items, list):
+            raise ValueError(f"{where}.items must be a list")
+        for item_index, item in enumerate(items):
+            item_where = f"{where}.items[{item_index}]"
+            if not isinstance(item, dict) or not str(item.get("item_name", "")).strip():
+                raise ValueError(f"{item_where} must be an object with item_name")
+            quantity = item.get("quantity")
+            if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+                raise ValueError(f"{item_where}.quantity must be a positive integer")
+            category = item.get("category")
+            item_rows.append(
+                (
+                    transaction_id,
+                    str(item["item_name"]).strip(),
+                    str(category) if category is not None else None,
+                    quantity,
+                    parse_amount(item.get("unit_price"), f"{item_where}.unit_price"),
+                )
+            )
+    return tx_rows, item_rows
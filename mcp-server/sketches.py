@@ -0,0 +1,63 @@
+# Heavy-hitter summaries: one weighted Space-Saving sketch per merchant, day and
+# dimension, stored as {key: [count, error]}. For every tracked key
+# count - error <= true quantity <= count, and any untracked key's quantity is
+# at most the sketch minimum once the sketch is full.
+from typing import Any
+
+
+def sketch_floor(counters: dict[str, list[int]], capacity: int) -> int:
+    if len(counters) < capacity:
+        return 0
+    return min(count for count, _ in counters.values())
+
+
+def space_saving_update(counters: dict[str, list[int]], key: str, weight: int, capacity: int) -> None:
+    if key in counters:
+        counters[key][0] += weight
+        return
+    if len(counters) < capacity:
+        counters[key] = [weight, 0]
+        return
+    evicted = min(counters, key=lambda k: counters[k][0])
+    floor = counters.pop(evicted)[0]
+    counters[key] = [floor + weight, floor]
+
+
+def sketch_from_totals(totals: dict[str, int], capacity: int) -> dict[str, list[int]]:
+    # Exact per-day top-k has error 0 and satisfies the Space-Saving bound
+    # (every dropped key is <= the k-th count).
+    ranked = sorted(totals.items(), key=lambda kv: (-kv[1], kv[0]))[:capacity]
+    return {key: [qty, 0] for key, qty in ranked}
+
+
+def merge_sketches(sketches: list[tuple[dict[str, list[int]], int]]) -> tuple[dict[str, list[int]], int]:
+    # A key missing from one day's sketch may still have up to that day's
+    # floor there, so it is credited the floor as both count and error.
+    total_floor = sum(sketch_floor(counters, capacity) for counters, capacity in sketches)
+    merged: dict[str, list[int]] = {}
+    for counters, capacity in sketches:
+        floor = sketch_floor(counters, capacity)
+        for key, (count, error) in counters.items():
+            entry = merged.setdefault(key, [total_floor, total_floor])
+            entry[0] += count - floor
+            entry[1] += error - floor
+    return merged, total_floor
+
+
+def sketch_top(merged: dict[str, list[int]], unseen_bound: int) -> dict[str, Any]:
+    if not merged:
+        return {"name": None, "qty": 0, "exact": unseen_bound == 0, "candidates": []}
+    ranked = sorted(merged.items(), key=lambda kv: (-kv[1][0], kv[0]))
+    name, (count, error) = ranked[0]
+    lower = count - error
+    rivals = [k for k, (c, _) in ranked[1:] if c >= lower]
+    return {
+        "name": name,
+        "qty": count,
+        "error": error,
+        # Unambiguous only if no rival (tracked or not) could reach the
+        # leader's guaranteed quantity and the leader's count has no error.
+        "decided": not rivals and unseen_bound < lower,
+        "exact": not rivals and unseen_bound < lower and error == 0,
+        "candidates": [name, *rivals] if unseen_bound < lower else None,
+    }
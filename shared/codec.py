@@ -0,0 +1,79 @@
+import re
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - stdlib fallback for local scripts
+    orjson = None
+    import json
+
+
+_FENCED_JSON = re.compile(r"```(?:json)?\s*(\{[\s\S]*?\})\s*```")
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def dumps(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value, default=_default)
+    return json.dumps(value, default=_default, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_text(value: Any) -> str:
+    return dumps(value).decode("utf-8")
+
+
+def loads(data: str | bytes | bytearray | memoryview) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = bytes(data).decode("utf-8")
+    return json.loads(data)
+
+
+def _loads_object(text: str) -> dict[str, Any] | None:
+    try:
+        parsed = loads(text)
+    except ValueError:
+        return None
+    return parsed if isinstance(parsed, dict) else None
+
+
+def parse_tool_result(result: Any) -> dict[str, Any] | None:
+    # MCP adapters hand back either the decoded dict, the raw text, or a list of
+    # content blocks; pick the first JSON-looking text and decode it once.
+    if isinstance(result, dict):
+        if "ok" in result or not isinstance(result.get("text"), str):
+            return result
+        result = result["text"]
+    if isinstance(result, (str, bytes, bytearray)):
+        return _loads_object(result)
+    if isinstance(result, (list, tuple)):
+        for item in result:
+            text = item.get("text") if isinstance(item, dict) else getattr(item, "text", item)
+            if isinstance(text, str) and text.lstrip().startswith("{"):
+                return _loads_object(text)
+    return None
+
+
+def extract_json_object(text: str) -> dict[str, Any] | None:
+    # Choose the single most likely JSON candidate (bare object, fenced block,
+    # or outermost braces) before parsing so an LLM reply is decoded once.
+    content = text.strip()
+    if not (content.startswith("{") and content.endswith("}")):
+        fence_match = _FENCED_JSON.search(content)
+        if fence_match:
+            return _loads_object(fence_match.group(1))
+    first_brace = content.find("{")
+    last_brace = content.rfind("}")
+    if first_brace == -1 or last_brace <= first_brace:
+        return None
+    return _loads_object(content[first_brace : last_brace + 1])
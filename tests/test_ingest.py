@@ -0,0 +1,70 @@
+import sys
+from datetime import datetime
+from decimal import Decimal
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "mcp-server"))
+
+from ingest import parse_ingest_batch  # noqa: E402
+
+
+def _tx(**overrides):
+    tx = {
+        "transaction_id": "6f1c2d1e-8a4b-4a57-9a55-0c3e1f2b7d10",
+        "merchant_id": "01",
+        "gross_amount": 50000,
+        "fee_deducted": 500,
+        "status": "SUCCESS",
+        "payment_method": "QRIS",
+        "created_at": "2026-03-01T18:22:05",
+        "items": [{"item_name": "Beras 5kg", "category": "Grocery", "quantity": 1, "unit_price": 50000}],
+    }
+    tx.update(overrides)
+    return tx
+
+
+def test_valid_batch_defaults_net_amount():
+    tx_rows, item_rows = parse_ingest_batch([_tx()])
+    assert tx_rows[0][2:5] == (Decimal("50000"), Decimal("49500"), Decimal("500"))
+    assert tx_rows[0][7] == datetime(2026, 3, 1, 18, 22, 5)
+    assert item_rows[0][1:4] == ("Beras 5kg", "Grocery", 1)
+
+
+@pytest.mark.parametrize("key", ["transaction_id", "merchant_id", "payment_method", "created_at"])
+def test_missing_key_is_rejected(key):
+    tx = _tx()
+    del tx[key]
+    with pytest.raises(ValueError, match=f"missing {key}"):
+        parse_ingest_batch([tx])
+
+
+def test_bad_status_is_rejected():
+    with pytest.raises(ValueError, match="status must be one of"):
+        parse_ingest_batch([_tx(status="SETTLED")])
+
+
+@pytest.mark.parametrize("amount", ["NaN", "Infinity", "-inf"])
+def test_non_finite_amount_is_rejected(amount):
+    with pytest.raises(ValueError, match="gross_amount must be finite"):
+        parse_ingest_batch([_tx(gross_amount=amount)])
+
+
+def test_non_numeric_amount_is_rejected():
+    with pytest.raises(ValueError, match="unit_price must be numeric"):
+        parse_ingest_batch([_tx(items=[{"item_name": "Gula", "quantity": 1, "unit_price": "abc"}])])
+
+
+def test_aware_timestamp_is_converted_to_utc():
+    tx_rows, _ = parse_ingest_batch([_tx(created_at="2026-03-01T23:30:00+07:00")])
+    assert tx_rows[0][7] == datetime(2026, 3, 1, 16, 30)
+    tx_rows, _ = parse_ingest_batch([_tx(created_at="2026-03-01T20:00:00-05:00")])
+    assert tx_rows[0][7] == datetime(2026, 3, 2, 1, 0)
+
+
+@pytest.mark.parametrize("quantity", [True, False, 0, -1, 1.5, "2"])
+def test_invalid_quantity_is_rejected(quantity):
+    with pytest.raises(ValueError, match="quantity must be a positive integer"):
+        parse_ingest_batch([_tx(items=[{"item_name": "Gula", "quantity": quantity, "unit_price": 1}])])
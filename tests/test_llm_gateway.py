@@ -0,0 +1,146 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from agent import llm_gateway  # noqa: E402
+from agent.llm_gateway import (  # noqa: E402
+    AdaptiveConcurrencyLimiter,
+    CircuitBreaker,
+    LLMGateway,
+    TokenBucket,
+)
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Replaces only the module's view of ``time``; asyncio keeps the real clock.
+    fake = FakeClock()
+    monkeypatch.setattr(llm_gateway, "time", fake)
+    return fake
+
+
+def test_token_bucket_reserve_refill_and_refund(clock):
+    bucket = TokenBucket(60)  # 1 token per second
+    assert bucket.reserve(50) == 0.0
+    assert bucket.reserve(20) == pytest.approx(10.0)
+    clock.now += 4
+    assert bucket.available() == pytest.approx(-6.0)
+    clock.now += 100
+    assert bucket.available() == 60.0
+    assert bucket.reserve(1000) == pytest.approx(0.0)  # clamped to capacity
+    bucket.refund(1000)
+    assert bucket.available() == 60.0
+
+
+def test_from_env_rejects_non_positive_rate_limits(monkeypatch):
+    monkeypatch.setenv("AGENT_LLM_RPM", "0")
+    with pytest.raises(ValueError, match="AGENT_LLM_RPM"):
+        LLMGateway.from_env()
+    monkeypatch.setenv("AGENT_LLM_RPM", "60")
+    monkeypatch.setenv("AGENT_LLM_TPM", "-1")
+    with pytest.raises(ValueError, match="AGENT_LLM_TPM"):
+        LLMGateway.from_env()
+
+
+def test_limiter_aimd():
+    async def scenario() -> None:
+        limiter = AdaptiveConcurrencyLimiter(initial=2, min_limit=1, max_limit=3, target_latency_seconds=1.0)
+        # +1 after a full window (= limit) of fast successes, capped at max.
+        for _ in range(2):
+            assert await limiter.acquire()
+            await limiter.release(True, 0.1)
+        assert limiter.limit == 3
+        for _ in range(3):
+            assert await limiter.acquire()
+            await limiter.release(True, 0.1)
+        assert limiter.limit == 3
+        # Neutral releases leave the limit alone.
+        assert await limiter.acquire()
+        await limiter.release(None, None)
+        assert limiter.limit == 3
+        # A slow success or an error halves it, down to min.
+        assert await limiter.acquire()
+        await limiter.release(True, 5.0)
+        assert limiter.limit == 1
+        assert await limiter.acquire()
+        await limiter.release(False, None)
+        assert limiter.limit == 1
+        assert limiter.inflight == 0
+
+    asyncio.run(scenario())
+
+
+def test_limiter_timed_acquire_does_not_leak_slot():
+    async def scenario() -> None:
+        limiter = AdaptiveConcurrencyLimiter(initial=1, min_limit=1, max_limit=1, target_latency_seconds=1.0)
+        assert await limiter.acquire()
+        assert not await limiter.acquire(0.01)
+        assert (limiter.inflight, limiter.waiting) == (1, 0)
+        await limiter.release(None, None)
+        assert await limiter.acquire(0.01)
+
+    asyncio.run(scenario())
+
+
+def test_circuit_breaker_opens_cools_down_and_probes(clock):
+    breaker = CircuitBreaker(failure_threshold=2, cooldown_seconds=30)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and breaker.trips == 1
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    # One probe at a time while half open.
+    assert breaker.allow() and breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and breaker.trips == 2
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.consecutive_failures == 0
+
+
+def test_backoff_is_full_jitter_with_cap(monkeypatch):
+    bounds = []
+
+    class FakeRandom:
+        @staticmethod
+        def uniform(low: float, high: float) -> float:
+            bounds.append((low, high))
+            return high
+
+    monkeypatch.setattr(llm_gateway, "random", FakeRandom)
+    gateway = LLMGateway(backoff_base_seconds=0.5, backoff_max_seconds=3.0)
+    assert [gateway._backoff(attempt) for attempt in range(4)] == [0.5, 1.0, 2.0, 3.0]
+    assert all(low == 0 for low, _ in bounds)
+
+
+def test_invoke_deadline_cut_short_is_neutral():
+    async def scenario() -> None:
+        gateway = LLMGateway(initial_concurrency=4, breaker_failure_threshold=1)
+
+        async def slow() -> None:
+            await asyncio.sleep(1)
+
+        with pytest.raises(asyncio.TimeoutError):
+            await gateway.invoke(slow, deadline=llm_gateway.time.monotonic() + 0.02)
+        assert gateway.limiter.limit == 4
+        assert gateway.breaker.state == CircuitBreaker.CLOSED
+        assert gateway.limiter.inflight == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,144 @@
+import random
+import sys
+from collections import Counter
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "mcp-server"))
+
+from sketches import (  # noqa: E402
+    merge_sketches,
+    sketch_floor,
+    sketch_from_totals,
+    sketch_top,
+    space_saving_update,
+)
+
+
+def _day_stream(rng: random.Random, keys: int, events: int) -> list[tuple[str, int]]:
+    # Skewed key popularity with a long tail, so small sketches must evict.
+    weights = [1 / (rank + 1) for rank in range(keys)]
+    names = [f"item-{rank:03d}" for rank in range(keys)]
+    return [(rng.choices(names, weights)[0], rng.randint(1, 5)) for _ in range(events)]
+
+
+def _build(stream: list[tuple[str, int]], capacity: int) -> dict[str, list[int]]:
+    counters: dict[str, list[int]] = {}
+    for key, weight in stream:
+        space_saving_update(counters, key, weight, capacity)
+    return counters
+
+
+def _check_bounds(counters: dict[str, list[int]], truth: Counter, floor: int) -> None:
+    for key, (count, error) in counters.items():
+        assert count - error <= truth[key] <= count, key
+    for key, qty in truth.items():
+        if key not in counters:
+            assert qty <= floor, key
+
+
+def test_space_saving_update_keeps_error_bounds():
+    rng = random.Random(7)
+    for capacity in (1, 4, 16):
+        stream = _day_stream(rng, keys=60, events=500)
+        counters = _build(stream, capacity)
+        truth: Counter = Counter()
+        for key, weight in stream:
+            truth[key] += weight
+        assert len(counters) <= capacity
+        assert sum(count for count, _ in counters.values()) == sum(truth.values())
+        _check_bounds(counters, truth, sketch_floor(counters, capacity))
+
+
+def test_merge_sketches_keeps_error_bounds_across_days():
+    rng = random.Random(11)
+    capacity = 8
+    sketches = []
+    truth: Counter = Counter()
+    for _ in range(14):
+        stream = _day_stream(rng, keys=40, events=rng.randint(0, 200))
+        sketches.append((_build(stream, capacity), capacity))
+        for key, weight in stream:
+            truth[key] += weight
+    merged, unseen_bound = merge_sketches(sketches)
+    assert unseen_bound == sum(sketch_floor(counters, cap) for counters, cap in sketches)
+    _check_bounds(merged, truth, unseen_bound)
+
+
+def test_merge_of_unfilled_sketches_is_exact():
+    day1 = {"a": [5, 0], "b": [2, 0]}
+    day2 = {"b": [4, 0], "c": [1, 0]}
+    merged, unseen_bound = merge_sketches([(day1, 8), (day2, 8)])
+    assert unseen_bound == 0
+    assert merged == {"a": [5, 0], "b": [6, 0], "c": [1, 0]}
+    top = sketch_top(merged, unseen_bound)
+    assert top["exact"] and top["name"] == "b" and top["qty"] == 6
+
+
+def test_sketch_top_flags_ambiguous_leader():
+    # The runner-up's count reaches the leader's guaranteed quantity.
+    top = sketch_top({"a": [10, 4], "b": [7, 0]}, unseen_bound=0)
+    assert not top["decided"] and top["candidates"] == ["a", "b"]
+    # An untracked key could still beat the leader.
+    top = sketch_top({"a": [10, 0]}, unseen_bound=10)
+    assert not top["decided"] and top["candidates"] is None
+    # Decided but with count error: needs an exact count of the leader.
+    top = sketch_top({"a": [10, 2], "b": [7, 0]}, unseen_bound=3)
+    assert top["decided"] and not top["exact"] and top["candidates"] == ["a"]
+
+
+def test_sketch_top_leader_matches_truth_when_decided():
+    rng = random.Random(3)
+    for _ in range(50):
+        capacity = rng.choice((4, 8, 16))
+        sketches = []
+        truth: Counter = Counter()
+        for _ in range(rng.randint(1, 7)):
+            stream = _day_stream(rng, keys=30, events=rng.randint(0, 120))
+            sketches.append((_build(stream, capacity), capacity))
+            for key, weight in stream:
+                truth[key] += weight
+        top = sketch_top(*merge_sketches(sketches))
+        if top["decided"]:
+            leader = truth[top["name"]]
+            assert all(qty < leader for key, qty in truth.items() if key != top["name"])
+
+
+def test_sketch_from_totals_keeps_exact_top_k():
+    counters = sketch_from_totals({"a": 5, "b": 9, "c": 1, "d": 5}, capacity=3)
+    assert counters == {"b": [9, 0], "a": [5, 0], "d": [5, 0]}
+    _check_bounds(counters, Counter({"a": 5, "b": 9, "c": 1, "d": 5}), sketch_floor(counters, 3))
+
+
+def test_new_day_from_ingest_is_covered_without_rebuild():
+    # Days 1-3 were rebuilt; day 4 first arrives in an ingest batch, which
+    # creates its sketch from the delta and later batches fold into it.
+    rng = random.Random(5)
+    capacity = 8
+    truth: Counter = Counter()
+    sketches = {}
+    for day in range(3):
+        day_truth: Counter = Counter()
+        for key, weight in _day_stream(rng, keys=20, events=80):
+            day_truth[key] += weight
+        sketches[day] = sketch_from_totals(dict(day_truth), capacity)
+        truth.update(day_truth)
+
+    first_batch = _day_stream(rng, keys=20, events=40)
+    delta: Counter = Counter()
+    for key, weight in first_batch:
+        delta[key] += weight
+    sketches[3] = sketch_from_totals(dict(delta), capacity)
+    truth.update(delta)
+    for key, weight in _day_stream(rng, keys=20, events=40):
+        space_saving_update(sketches[3], key, weight, capacity)
+        truth[key] += weight
+
+    # One sketch per day of the window, so the coverage check passes, and the
+    # merged bounds still hold for the ingested day.
+    assert sorted(sketches) == [0, 1, 2, 3]
+    merged, unseen_bound = merge_sketches([(counters, capacity) for counters in sketches.values()])
+    _check_bounds(merged, truth, unseen_bound)
+    top = sketch_top(merged, unseen_bound)
+    if top["decided"]:
+        assert all(qty < truth[top["name"]] for key, qty in truth.items() if key != top["name"])